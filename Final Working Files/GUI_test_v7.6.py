@@ -4,10 +4,15 @@ import tkinter.messagebox as messagebox
 import threading
 import time
 from NEMA17mod2 import Nema17  # Import the Nema17 class from the driver file
-from MCP9808mod5 import MCP9808
+from MCP9808mod5 import MCP9808Array, AdaptiveSampler
 import multiprocessing
+import os
+import signal
 from PCA9685mod3 import PCA9685Controller #, LEDShow #LED, RGBLED?
 from musicmod import MusicPlayer
+from busownermod import BusOwner
+from motorworkermod import MotorWorker
+from tempslotmod import TemperatureSlot
 import queue
 
 
@@ -27,18 +32,109 @@ SLP --> GPIO 23
 tie grounds
 '''
 
+# pin the motor worker to its own core with SCHED_FIFO where permitted, see motorworkermod
+MOTOR_REALTIME = False
+
+# temperature limits, programmed into the MCP9808s, defaults for a sensor not in TEMP_SENSORS
+TEMP_THRESHOLD = 32.0  # TUPPER, above this the GUI warns or starts the emergency countdown
+TEMP_WARNING = 30.0  # TLOWER, crossing it upwards is an early warning event
+TEMP_CRITICAL = 40.0  # TCRIT
+# sensor address -> (name, TLOWER, TUPPER trip, TCRIT), the monitor probes 0x18 to 0x1F and uses what it finds
+TEMP_SENSORS = {
+    0x18: ('motor', TEMP_WARNING, TEMP_THRESHOLD, TEMP_CRITICAL),
+    0x19: ('pi', 60.0, 70.0, 80.0),
+    0x1A: ('battery', 35.0, 40.0, 45.0),
+}
+TEMP_DEADBAND = 0.25  # publish when the temperature moved this far from the last published value
+TEMP_ALERT_PIN = None  # BCM pin wired to the MCP9808 ALERT output (open drain, active low), None if floating
+
 # define processes here, not inside GUI to prevent lockup
 
-def temperature_monitor(queue):
-    temp_sensor = MCP9808()
+def sensor_limits(address):
+    return TEMP_SENSORS.get(address, (f'0x{address:02X}', TEMP_WARNING, TEMP_THRESHOLD, TEMP_CRITICAL))
+
+
+def temperature_monitor(slot, bus=None, alert_pin=TEMP_ALERT_PIN):
+    '''
+    Temperature worker. Probes the MCP9808 addresses once, programs each sensor's limits and
+    ALERT output, then reads all of them in one pass per interval and publishes the whole
+    vector into the shared TemperatureSlot when a limit flag changes, a sensor is lost or
+    comes back, or a value leaves the deadband.
+    An AdaptiveSampler per sensor sets its resolution and when it is read next: fast and coarse
+    near its trip, slow and fine when far from it and steady. Each pass only reads the sensors
+    that are due, so a steady sensor is not polled at the rate of a heating one.
+    With alert_pin wired (the ALERT outputs are open drain and can share it) it wakes as soon
+    as ALERT changes and reads every sensor whose conversion has finished.
+    '''
+    def setup(sensor):
+        _, lower, upper, critical = sensor_limits(sensor.i2c_addr)
+        sensor.set_resolution(0.0625)  # known starting point for the sampler
+        sensor.set_limits(lower=lower, upper=upper, critical=critical)
+        sensor.configure_alert()  # comparator mode, ALERT is asserted while outside the window
+
+    sensors = MCP9808Array(bus=bus, setup=setup, streaming=True)  # pointer stays on the temperature register
+    while not sensors.probe():
+        print("No temperature sensor found")
+        if slot.read()['reason'] != 'no sensor found':
+            slot.invalidate('no sensor found')
+        time.sleep(MCP9808Array.RETRY_INTERVAL)
+    print(f"Temperature sensors: {', '.join(sensor_limits(address)[0] for address in sensors.sensors)}")
+    samplers = {address: AdaptiveSampler(sensor_limits(address)[2]) for address in sensors.sensors}
+    if alert_pin is not None:
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(alert_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+
+    latest = {}  # address -> last temperature read
+    published = {}  # address -> temperature in the last publish
+    last_flags = {}  # address -> flags in the last publish, None while the sensor is lost
+    alerted = False
     while True:
         try:
-            temperature = temp_sensor.threebit_read_temperature()
-            queue.put(temperature)
-            time.sleep(2)
+            readings = sensors.read_all(force=alerted)
+            now = time.monotonic()
+            reasons = []
+            with sensors.bus.batch():  # resolution changes go out together
+                for address, reading in readings.items():
+                    name = sensor_limits(address)[0]
+                    previous = last_flags.get(address)
+                    if reading is None:
+                        if previous is not None:
+                            reasons.append(f"{name} lost")
+                            last_flags[address] = None
+                        continue
+                    temperature, flags = reading
+                    latest[address] = temperature
+                    resolution, wait = samplers[address].update(temperature, now)
+                    if resolution != sensors.sensors[address].resolution:
+                        sensors.sensors[address].set_resolution(resolution)
+                    sensors.schedule(address, wait)
+                    if previous is None:
+                        reasons.append(f"{name} start" if address not in published else f"{name} back")
+                    elif flags != previous:
+                        reasons.extend(f"{name} {flag} {'set' if flags[flag] else 'cleared'}"
+                                       for flag in flags if flags[flag] != previous[flag])
+                    elif abs(temperature - published[address]) >= TEMP_DEADBAND:
+                        reasons.append(f"{name} deadband")
+            if reasons:
+                slot.publish([(address, latest.get(address, 0.0), sensor_limits(address)[2],
+                               address in latest and address not in sensors.lost)
+                              for address in sensors.sensors], ', '.join(reasons))
+                for address, reading in readings.items():
+                    if reading is not None:
+                        published[address] = reading[0]
+                        last_flags[address] = reading[1]
         except Exception as e:
             print(f"Error reading temperature: {e}")
+            if slot.read()['valid']:
+                slot.invalidate(f"sensor error: {e}")
+                last_flags.clear()
             time.sleep(1)
+            continue
+        wait = max(0.0, sensors.next_due() - time.monotonic())
+        if alert_pin is not None:
+            alerted = GPIO.wait_for_edge(alert_pin, GPIO.BOTH, timeout=max(1, int(wait * 1000))) is not None
+        else:
+            time.sleep(wait)
 
 def music_control_process(queue):
     try:
@@ -65,24 +161,78 @@ def music_control_process(queue):
         player.cleanup()
 
 
-def led_control_process(queue):
-    controller = PCA9685Controller()
+def led_control_process(led_queue, bus=None, temp_slot=None):
+    '''
+    LED worker. Commands arrive as (command, sent_at) with sent_at from time.monotonic(),
+    which is shared between processes, so command-to-effect latency can be measured here.
+    The effect time is taken after controller.sync(), so it includes the time the writes
+    spent queued in the bus owner.
+    temp_slot: the shared TemperatureSlot, the EXIT summary lists the temperatures it ended with.
+    Shows run in a thread so a new command can cancel them at the next frame boundary.
+    '''
+    controller = PCA9685Controller(bus=bus)
     led_show = controller.create_light_show()
     led_show.all_off()
-    
+    show_thread = None
+    latencies = []
+
+    def report_latency(command, sent_at, effect_at):
+        latency = effect_at - sent_at
+        latencies.append(latency)
+        print(f"LED {command}: {latency * 1000:.1f} ms command-to-effect")
+
+    def run_show(command, sent_at):
+        show_name = command.split(":")[1]
+        stats = led_show.run_light_show(show_name, duration=15)
+        if stats:
+            if stats['first_frame_at'] is not None:
+                report_latency(command, sent_at, stats['first_frame_at'])
+            if stats['elapsed'] < 1 / stats['target_fps']:
+                # replaced by the next command before one frame period was up, there is no rate to report
+                print(f"LED show {show_name}: preempted after {stats['frames']} frame(s)")
+                return
+            print(f"LED show {show_name}: {stats['fps']:.1f}/{stats['target_fps']:.0f} fps, "
+                  f"{stats['dropped']} frames dropped, ran {stats['elapsed']:.2f}s"
+                  f"{' (preempted)' if stats['cancelled'] else ''}")
+        else:
+            report_latency(command, sent_at, controller.sync())
+
     while True:
-        command = queue.get()
-        if command == "EXIT":
-            led_show.all_off()
-            break
-        elif command == "MASTER_ON":
-            led_show.all_on()
-        elif command == "MASTER_OFF":
-            led_show.all_off()
-        elif command.startswith("SHOW:"):
-            show_name = command.split(":")[1]
-            led_show.run_light_show(show_name, duration=15)
-            led_show.all_on()  # Return to all LEDs on after the show
+        commands = [led_queue.get()]
+
+        # preempt the running show, it stops within one frame
+        if show_thread is not None and show_thread.is_alive():
+            controller.cancel_event.set()
+            show_thread.join()
+        controller.cancel_event.clear()
+
+        try:
+            while True:
+                commands.append(led_queue.get_nowait())
+        except queue.Empty:
+            pass
+        # a SHOW with anything queued behind it would be preempted straight away, keep only the latest
+        commands = [c for i, c in enumerate(commands)
+                    if not (c[0].startswith("SHOW:") and i < len(commands) - 1)]
+
+        for command, sent_at in commands:
+            if command == "EXIT":
+                controller.master_off()
+                if latencies:
+                    print(f"LED command latency over {len(latencies)} commands: "
+                          f"mean {sum(latencies) / len(latencies) * 1000:.1f} ms, max {max(latencies) * 1000:.1f} ms")
+                if temp_slot is not None:
+                    print(f"Temperatures at LED exit: {temp_slot.summary()}")
+                return
+            elif command == "MASTER_ON":
+                led_show.all_on()
+                report_latency(command, sent_at, controller.sync())
+            elif command == "MASTER_OFF":
+                controller.master_off()  # single ALL_LED write
+                report_latency(command, sent_at, controller.sync())
+            elif command.startswith("SHOW:"):
+                show_thread = threading.Thread(target=run_show, args=(command, sent_at), daemon=True)
+                show_thread.start()
 
 class WindmillGUI:
     def __init__(self, master):
@@ -100,16 +250,31 @@ class WindmillGUI:
 
         self.on = False  # Define 'on' here
 
-        # initialize multiprocessing for temperature sensor
-        self.temp_queue = multiprocessing.Queue()
-        self.temp_process = multiprocessing.Process(target=temperature_monitor, args=(self.temp_queue,))
+        # latest temperatures in shared memory, made first so every worker process inherits it
+        self.temp_slot = TemperatureSlot()
+
+        # one motor process for the whole session, settings go through shared memory
+        self.motor_worker = MotorWorker(self.motor, realtime=MOTOR_REALTIME, temp_slot=self.temp_slot,
+                                        **self.motor_settings)
+        self.motor_worker.start()
+
+        # one process owns the I2C bus, temperature reads are served before LED frames
+        self.bus_owner = BusOwner()
+        temp_bus = self.bus_owner.create_client('mcp9808', BusOwner.PRIORITY_TEMPERATURE)
+        led_bus = self.bus_owner.create_client('pca9685', BusOwner.PRIORITY_LED)
+        self.bus_owner.start()
+
+        # initialize multiprocessing for temperature sensor, it publishes into self.temp_slot
+        self.temp_process = multiprocessing.Process(target=temperature_monitor, args=(self.temp_slot, temp_bus))
         self.temp_process.start()
         
-        self.master.after(100, self.update_temperature) # update temperature from queue after 100ms
+        # the monitor only publishes on events, a thread waits on the slot and hands them to Tk.
+        # Tk only takes after() calls from other threads once mainloop runs, so start it from there
+        self.master.after(0, self.start_temperature_listener)
         
         # initialize multiprocessing for LED control
         self.led_queue = multiprocessing.Queue()
-        self.led_process = multiprocessing.Process(target=led_control_process, args=(self.led_queue,))
+        self.led_process = multiprocessing.Process(target=led_control_process, args=(self.led_queue, led_bus, self.temp_slot))
         self.led_process.start()
 
         # initialize music stuff
@@ -264,6 +429,11 @@ class WindmillGUI:
         self.status_label = ctk.CTkLabel(frame, textvariable=self.status_var, font=("Helvetica", 12, "bold"))
         self.status_label.pack(pady=10)
 
+        # measured speed and rotor angle, read straight from the motor worker's shared telemetry
+        self.telemetry_var = ctk.StringVar(value="Measured: 0.0 RPM")
+        ctk.CTkLabel(frame, textvariable=self.telemetry_var, font=("Helvetica", 12)).pack(pady=(0, 10))
+        self.master.after(500, self.update_motor_telemetry)
+
     ##########################################################
     '''begin class methods/functions to use within the GUI'''
     ##########################################################
@@ -309,12 +479,24 @@ class WindmillGUI:
     # LED methods
     def toggle_led_master(self):
         if self.led_master_var.get():
-            self.led_queue.put("MASTER_ON")
+            self.send_led_command("MASTER_ON")
         else:
-            self.led_queue.put("MASTER_OFF")
+            self.send_led_command("MASTER_OFF")
 
     def start_led_show(self, choice):
-        self.led_queue.put(f"SHOW:{choice}")
+        self.send_led_command(f"SHOW:{choice}")
+
+    def dump_bus_metrics(self):
+        '''
+        Ask the bus owner to write its I2C metrics and per-client queueing delay,
+        it prints the path of its /tmp/i2c_metrics_bus-owner_<pid>.json file
+        '''
+        if self.bus_owner.process.is_alive():
+            os.kill(self.bus_owner.process.pid, signal.SIGUSR1)
+
+    def send_led_command(self, command):
+        # timestamped so the LED process can measure command-to-effect latency
+        self.led_queue.put((command, time.monotonic()))
 
 
     # Motor control methods
@@ -350,14 +532,10 @@ class WindmillGUI:
                 self.motor_settings['rpm'] = rpm
                 self.motor_settings['direction'] = direction
                 self.motor_settings['step_mode'] = step_mode
-                
-            if hasattr(self, 'motor_process') and self.motor_process.is_alive():
-                self.motor_process.terminate()  # Terminate previous motor process
-            
-            self.motor.sleep()
-            print("Motor sleeping...")
-            self.start_motor()
-        
+
+            # the running worker picks these up at its next step, speed changes ramp
+            self.motor_worker.configure(rpm, direction, step_mode)
+
             status = f"RPM: {rpm:.2f}, Direction: {direction}, Mode: {step_mode}"
             #messagebox.showinfo("Success", status) # do you still need to double click to apply changes?
             print(f'starting motor {status}')
@@ -381,41 +559,21 @@ class WindmillGUI:
             self.status_var.set("Motor Running")
         else:
             print('Motor OFF')
-            if hasattr(self, 'motor_process') and self.motor_process.is_alive():
-                self.motor_process.terminate()  # Ensure motor process is terminated
-                print("Motor process terminated.")
-            self.motor.sleep_main_motor()
+            self.motor_worker.set_running(False)  # worker puts the driver to sleep
+            print("Motor stopped.")
             self.status_var.set("Motor Stopped")
 
     def start_motor(self):
         print('Starting motor...')
-        
-        # Start motor in a separate process
-        if not hasattr(self, 'motor_process') or not self.motor_process.is_alive():
-            self.motor_process = multiprocessing.Process(target=self.run_motor)
-            self.motor_process.start()
-
-    def run_motor(self):
-        rpm = self.motor_settings['rpm']
-        direction = self.motor_settings['direction']
-        
-        print(f"Running motor at {rpm} RPM in {direction} direction.")
-        
-        self.motor.wake()
-        print('motor awake. All pins set to 0, sleep on HIGH')
-
-        while self.on:  
-            if direction == "CW":
-                if self.motor_settings['step_mode'] == "Full":
-                    self.motor.rotate_full_step(rpm)
-                else:
-                    self.motor.rotate_half_step(rpm)
-            else:  
-                if self.motor_settings['step_mode'] == "Full":
-                    self.motor.rotate_full_step_ccw(rpm)
-                else:
-                    self.motor.rotate_half_step_ccw(rpm)
-    
+        self.motor_worker.configure(**self.motor_settings)
+        self.motor_worker.set_running(True)
+
+    def update_motor_telemetry(self):
+        telemetry = self.motor_worker.read_telemetry()
+        self.telemetry_var.set(f"Measured: {telemetry['rpm']:.1f} RPM, {telemetry['steps']} steps, "
+                               f"rotor at {telemetry['angle']:.1f}°")
+        self.master.after(500, self.update_motor_telemetry)
+
     def sleep_main_motor(self):
         '''
         separate, more fancy than the NEMA17mod sleep function
@@ -426,26 +584,45 @@ class WindmillGUI:
             print("Motor sleeping and all motor pins set to OFF...")
 
     # Temperature MCP9808 methods
-    def update_temperature(self):
-        try:
-            temperature = self.temp_queue.get_nowait()
-            self.temp_label.configure(text=f"Temperature: {temperature:.2f}°C")
-            
-            # Check temperature safety
-            if temperature > 32.0:
-                self.raise_temperature_flag(temperature)
-                
-        except queue.Empty:
-            pass
-        finally:
-            self.master.after(100, self.update_temperature)
+    def start_temperature_listener(self):
+        self.temp_listener = threading.Thread(target=self.listen_temperature, daemon=True)
+        self.temp_listener.start()
 
-    def raise_temperature_flag(self, temperature):
+    def listen_temperature(self):
+        # the safety trip depends on this thread, an error is logged and the reading tried again
+        seq = 0
+        while True:
+            try:
+                reading = self.temp_slot.wait(seq)
+                self.master.after(0, self.update_temperature, reading)
+                seq = reading['seq']
+            except Exception as e:
+                print(f"Error in temperature listener: {e}")
+                time.sleep(0.5)
+
+    def update_temperature(self, reading):
+        if not reading['valid']:
+            self.temp_label.configure(text=f"Temperature: {reading['reason']}")
+            return
+        self.temp_label.configure(text="\n".join(
+            f"{sensor_limits(sensor['address'])[0].capitalize()}: "
+            + (f"{sensor['temperature']:.2f}°C" if sensor['valid'] else "--")
+            for sensor in reading['sensors']))
+        if not reading['reason'].endswith(('start', 'deadband')):
+            print(f"Temperature: {reading['reason']}")
+
+        # Check temperature safety, every sensor against its own trip
+        tripped = [sensor for sensor in reading['sensors'] if sensor['valid'] and sensor['temperature'] > sensor['trip']]
+        if tripped:
+            self.raise_temperature_flag(max(tripped, key=lambda sensor: sensor['temperature'] - sensor['trip']))
+
+    def raise_temperature_flag(self, sensor):
+        name = sensor_limits(sensor['address'])[0]
         if self.safety_mode.get():
-            self.show_emergency_dialog(f"EMERGENCY: Temperature Critical!\nCurrent: {temperature:.1f}°C\nThreshold: 32.0°C")
+            self.show_emergency_dialog(f"EMERGENCY: Temperature Critical!\n{name.capitalize()}: {sensor['temperature']:.1f}°C\nThreshold: {sensor['trip']:.1f}°C")
         else:
             messagebox.showwarning("Temperature Warning", 
-                "Temperature exceeds safety threshold!\nPlease consider closing the application.")
+                f"{name.capitalize()} temperature exceeds safety threshold!\nPlease consider closing the application.")
 
     def show_emergency_dialog(self, message):
         dialog = ctk.CTkToplevel(self.master)
@@ -491,8 +668,7 @@ class WindmillGUI:
     def emergency_shutdown(self):
         try:
             # Stop motor
-            if hasattr(self, 'motor_process') and self.motor_process.is_alive():
-                self.motor_process.terminate()
+            self.motor_worker.set_running(False)
             self.motor.sleep_main_motor()
             
             # Stop music and clear queue
@@ -506,8 +682,8 @@ class WindmillGUI:
             self.music_is_playing = False
             
             # Turn off LEDs
-            self.led_queue.put("LED:0")
-            self.led_var.set(False)
+            self.send_led_command("MASTER_OFF")
+            self.led_master_var.set(False)
             
             # Update GUI state
             self.power_var.set(False)
@@ -531,13 +707,11 @@ class WindmillGUI:
         if hasattr(self, 'temp_process') and self.temp_process.is_alive():
             self.temp_process.terminate()
         
-        if hasattr(self, 'motor_process') and self.motor_process.is_alive():
-            print('detected motor process running...')
-            self.motor_process.terminate()
-            print('terminated motor process.')
+        self.motor_worker.stop()
+        print('stopped motor worker.')
         self.sleep_main_motor()
         print('all motor pins off.')
-        self.led_queue.put("EXIT")
+        self.send_led_command("EXIT")
         self.led_process.join()
         self.master.destroy()
         print('destroyed master')
@@ -551,22 +725,22 @@ class WindmillGUI:
         '''
 
         try:
-            if hasattr(self, 'motor_process') and self.motor_process.is_alive():
-                self.motor_process.terminate()
-            
-            if self.running:
-                self.running = False
-                if self.motor_thread:
-                    self.motor_thread.join()
-            
+            self.motor_worker.stop()
+
             self.sleep_main_motor()
             print('all motor pins off.')
+            self.dump_bus_metrics()
             # Add music cleanup
             self.music_queue.put("EXIT")
             self.music_process.join()
             
-            self.led_queue.put("EXIT")
+            self.send_led_command("EXIT")
             self.led_process.join()
+            # the monitor only waits on the bus or sleeps, stop it before its bus client goes away
+            if self.temp_process.is_alive():
+                self.temp_process.terminate()
+            self.temp_process.join()
+            self.bus_owner.stop()
             self.master.quit()
         except Exception as e:
             print(f"Error during closing: {e}")
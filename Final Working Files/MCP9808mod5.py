@@ -14,100 +14,351 @@ Pin Configuration for Raspberry Pi 4:
   Floating all address pins results in address 0b000.
 """
 
-import smbus2
+import time
+from smbus2 import i2c_msg
+from smbusmod import InstrumentedSMBus
 
 class MCP9808:
 
     DEFAULT_ADDRESS = 0x18
     REG_CONFIG = 0x01
+    REG_TUPPER = 0x02
+    REG_TLOWER = 0x03
     REG_TEMPERATURE = 0x05
     REG_TCRITICAL = 0x04
+    REG_MANUFACTURER = 0x06
     REG_RESOLUTION = 0x08
+    MANUFACTURER_ID = 0x0054
 
-    def __init__(self, i2c_addr=DEFAULT_ADDRESS):
+    # CONFIG register bits
+    CONFIG_ALERT_MODE = 0x0001  # 0 comparator, 1 interrupt
+    CONFIG_ALERT_POL = 0x0002  # 1 active high
+    CONFIG_ALERT_SEL = 0x0004  # 1 alert only on TCRIT
+    CONFIG_ALERT_CNT = 0x0008  # alert output enabled
+    CONFIG_INT_CLEAR = 0x0020
+
+    # resolution (°C) -> (RESOLUTION register value, conversion time in s, datasheet typical)
+    RESOLUTIONS = {0.5: (0, 0.030), 0.25: (1, 0.065), 0.125: (2, 0.130), 0.0625: (3, 0.250)}
+
+    # flag bits in the temperature register
+    FLAG_CRITICAL = 0x8000  # TA >= TCRIT
+    FLAG_UPPER = 0x4000  # TA > TUPPER
+    FLAG_LOWER = 0x2000  # TA < TLOWER
+
+    # streaming checks: a reset or brown-out puts the chip's pointer back on register 0, and a plain
+    # read then decodes whatever that register holds
+    POINTER_REFRESH_READS = 10  # the pointer is written again on every this many streaming reads
+    PLAUSIBLE_RANGE = (-40.0, 125.0)  # °C, the sensor's operating range
+    MAX_JUMP = 10.0  # °C between two readings, more is taken as a wrong register
+
+    def __init__(self, i2c_addr=DEFAULT_ADDRESS, bus=None, streaming=False):
         self.i2c_addr = i2c_addr
-        self.bus = smbus2.SMBus(1)
+        # bus: optional already open bus object (e.g. a shared InstrumentedSMBus)
+        self.bus = bus if bus is not None else InstrumentedSMBus(1, name='mcp9808')
+        self.resolution = 0.0625  # power-on default
+        # streaming: the chip keeps its register pointer, so while it is on the temperature register
+        # a temperature read is a plain 2-byte read (one i2c_rdwr message) instead of pointer write,
+        # repeated start and read. The bus needs i2c_rdwr (smbus2, InstrumentedSMBus, BusClient)
+        self.streaming = streaming
+        self.pointer = None  # register the chip's pointer was last set to, None if unknown
+        self.stream_reads = 0  # plain reads since the pointer was last written
+        self.pointer_lost = False  # set when a streaming read looked like another register, see MCP9808Array
+        self._last_temperature = None  # °C of the last temperature register read, for the jump check
+
+    def probe(self):
+        """True if an MCP9808 answers at this address, checked by its manufacturer ID."""
+        try:
+            manufacturer = self._read_word(self.REG_MANUFACTURER)
+        except OSError:
+            return False  # nothing there, the address was NACKed
+        return manufacturer == self.MANUFACTURER_ID
 
     def configure(self, config_value=0):
 
-        config_value = self._swap_bytes(config_value)
-        self.bus.write_word_data(self.i2c_addr, self.REG_CONFIG, config_value)
-        read_config = self._swap_bytes(self.bus.read_word_data(self.i2c_addr, self.REG_CONFIG))
+        self._write_word(self.REG_CONFIG, config_value)
+        read_config = self._read_word(self.REG_CONFIG)
         print(f'Temperature sensor configured as: {bin(read_config)}')
 
 
     def read_temperature(self):
-        temphex = self.bus.read_word_data(self.i2c_addr, self.REG_TEMPERATURE)
-        #convert from big-endian to little-endian
-        temphex = ((temphex & 0x00ff) << 8) + ((temphex & 0xff00) >> 8)      
-        #Mask out the flag bits
-        temphex = temphex & 0x1fff       
-        #the sign bit
-        sign = (temphex & 0x1000) >> 12      
-        # Mask out the sign bit
-        temphex = temphex & 0xfff       
-        # Extract upper 8 bits
-        integer_part = temphex >> 4
-        
-        if sign:
-            return integer_part - 256
-        else:
-            return integer_part
+        """Read temperature in whole °C."""
+        return int(self.decode_temperature(self._read_temperature_register(), 1.0))
     
     def threebit_read_temperature(self):
         """Read temperature with exactly 0.125°C resolution using 3 fractional bits."""
-        # Read the 16-bit temperature register from the sensor
-        temphex = self.bus.read_word_data(self.i2c_addr, self.REG_TEMPERATURE)
-
-        # Convert from big-endian to little-endian
-        temphex = ((temphex & 0x00ff) << 8) + ((temphex & 0xff00) >> 8)      
-
-        # Mask out the 3 flag bits (keep only the lower 13 bits)
-        temphex = temphex & 0x1fff       
-
-        # exrtact the sign bit (bit 12 indicates whether the temperature is negative)
-        sign = (temphex & 0x1000) >> 12
-
-        # Mask out the sign bit (keep only the temperature data)
-        temphex = temphex & 0xfff
-        
-        # Extract the integer part (upper 8 bits)
-        integer_part = temphex >> 4  # Right shift by 4 to get the integer part
-        
-        # Extract the fractional part (lower 4 bits) but only use the top 3 bits for 0.125°C resolution
-        fractional_part = (temphex & 0xF) >> 1  # Shift right by 1 to discard the least significant bit
-
-        # Combine the integer part and the 3-bit fractional part
-        # Divide the fractional part by 8 to get 0.125°C resolution (since 2^3 = 8)
-        temperature = integer_part + (fractional_part / 8.0)
-
-        # If the sign bit was set, adjust the temperature for negative values using two's complement
-        if sign:
-            return temperature - 256  # For negative temperatures subtract 256
-        else:
-            return temperature
-   
+        return self.decode_temperature(self._read_temperature_register(), 0.125)
+
+    def read_temperature_flags(self, resolution=None):
+        """Read temperature and the limit flags in one transaction.
+        resolution: °C step to decode to, default the resolution the sensor is set to.
+        Returns (temperature, flags) with flags a dict of 'critical', 'upper', 'lower' booleans."""
+        temphex = self._read_temperature_register()
+        flags = {
+            'critical': bool(temphex & self.FLAG_CRITICAL),
+            'upper': bool(temphex & self.FLAG_UPPER),
+            'lower': bool(temphex & self.FLAG_LOWER),
+        }
+        return self.decode_temperature(temphex, resolution or self.resolution), flags
+
+    @staticmethod
+    def decode_temperature(temphex, resolution=0.0625):
+        """Temperature register value (already byte swapped) to °C, truncated down to the resolution step.
+        Every temperature read goes through here, 1.0 gives whole degrees, 0.125 the three bit reading."""
+        # Mask out the 3 flag bits, the rest is 13-bit two's complement in 1/16°C
+        counts = temphex & 0x1fff
+        if counts & 0x1000:
+            counts -= 0x2000
+        # floor to the step, like dropping the low fraction bits of the register
+        step = max(1, int(resolution * 16))
+        return (counts // step) * step / 16.0
+
+    def _read_temperature_register(self):
+        """Raw temperature register (byte swapped), a plain read when streaming and the pointer is already there.
+        Every POINTER_REFRESH_READS reads, and whenever a plain read gives an implausible value, the
+        register is read with the pointer written again."""
+        if not (self.streaming and self.pointer == self.REG_TEMPERATURE) or self.stream_reads >= self.POINTER_REFRESH_READS:
+            return self._read_full_temperature()
+        msg = i2c_msg.read(self.i2c_addr, 2)
+        try:
+            self.bus.i2c_rdwr(msg)
+        except OSError:
+            self.pointer = None  # set it again on the next read
+            raise
+        self.stream_reads += 1
+        high, low = list(msg)  # MSB first on the wire
+        temphex = (high << 8) | low
+        if not self._plausible(temphex):
+            print(f"MCP9808 at 0x{self.i2c_addr:02X}: implausible streaming read 0x{temphex:04X}, writing the pointer again")
+            self.pointer_lost = True
+            return self._read_full_temperature()
+        self._last_temperature = self.decode_temperature(temphex)
+        return temphex
+
+    def _read_full_temperature(self):
+        temphex = self._read_word(self.REG_TEMPERATURE)
+        self.stream_reads = 0
+        self._last_temperature = self.decode_temperature(temphex)
+        return temphex
+
+    def _plausible(self, temphex):
+        temperature = self.decode_temperature(temphex)
+        low, high = self.PLAUSIBLE_RANGE
+        if not low <= temperature <= high:
+            return False
+        return self._last_temperature is None or abs(temperature - self._last_temperature) <= self.MAX_JUMP
 
     def set_critical_temperature(self, temp_c):
 
         temp_encoded = self._encode_temperature(temp_c)
         self._write_word(self.REG_TCRITICAL, temp_encoded)
 
+    def set_upper_temperature(self, temp_c):
+        self._write_word(self.REG_TUPPER, self._encode_temperature(temp_c))
+
+    def set_lower_temperature(self, temp_c):
+        self._write_word(self.REG_TLOWER, self._encode_temperature(temp_c))
+
+    def set_limits(self, lower, upper, critical):
+        """Program the alert window (TLOWER, TUPPER) and TCRIT, all in °C with 0.25°C steps."""
+        self.set_lower_temperature(lower)
+        self.set_upper_temperature(upper)
+        self.set_critical_temperature(critical)
+
+    def configure_alert(self, interrupt=False, active_high=False, critical_only=False):
+        """Enable the ALERT output.
+        interrupt: latch until clear_alert() instead of following the temperature (comparator mode)
+        active_high: ALERT polarity, the pin is open drain and active low by default
+        critical_only: only assert above TCRIT instead of outside the TLOWER..TUPPER window"""
+        config = self._read_word(self.REG_CONFIG)
+        config &= ~(self.CONFIG_ALERT_MODE | self.CONFIG_ALERT_POL | self.CONFIG_ALERT_SEL | self.CONFIG_INT_CLEAR)
+        config |= self.CONFIG_ALERT_CNT
+        if interrupt:
+            config |= self.CONFIG_ALERT_MODE
+        if active_high:
+            config |= self.CONFIG_ALERT_POL
+        if critical_only:
+            config |= self.CONFIG_ALERT_SEL
+        self._write_word(self.REG_CONFIG, config)
+
+    def clear_alert(self):
+        """Release a latched interrupt-mode alert."""
+        config = self._read_word(self.REG_CONFIG)
+        self._write_word(self.REG_CONFIG, config | self.CONFIG_INT_CLEAR)
+
     def set_resolution(self, resolution=0.0625):
 
         resolution_map = {0.5: 0, 0.25: 1, 0.125: 2, 0.0625: 3}
+        self.pointer = self.REG_RESOLUTION
         self.bus.write_byte_data(self.i2c_addr, self.REG_RESOLUTION, resolution_map.get(resolution, 3))
+        self.resolution = resolution if resolution in resolution_map else 0.0625
+
+    @property
+    def conversion_time(self):
+        """Seconds one conversion takes at the current resolution, reading faster returns the old value."""
+        return self.RESOLUTIONS[self.resolution][1]
 
     def _swap_bytes(self, value):
 
         return ((value & 0xFF) << 8) | ((value & 0xFF00) >> 8)
 
+    def _read_word(self, reg):
+        """Read a 16-bit word from the specified register, the chip sends MSB first."""
+        self.pointer = None
+        value = self._swap_bytes(self.bus.read_word_data(self.i2c_addr, reg))
+        self.pointer = reg
+        return value
+
     def _write_word(self, reg, value):
         """Write a 16-bit word to the specified register."""
+        self.pointer = reg
         self.bus.write_word_data(self.i2c_addr, reg, self._swap_bytes(value))
 
     def _encode_temperature(self, temp_c):
-        """Encode temperature for writing to registers."""
-        if temp_c < 0:
-            return (int(abs(temp_c) * 16) & 0xFFF) ^ 0x1FFF + 1
-        return int(temp_c * 16) & 0xFFF
+        """Encode temperature for writing to the limit registers.
+        13-bit two's complement in 1/16°C, limits only keep 0.25°C steps (bits 12..2)."""
+        return (round(temp_c * 4) * 4) & 0x1FFC
+
+
+class MCP9808Array:
+    """Every MCP9808 on one bus (addresses 0x18 to 0x1F), read on one schedule.
+    probe() looks at each address once at startup, addresses that do not answer are never
+    touched again. Each sensor has its own next-due time: read_all() only reads the sensors
+    that are due, schedule() sets when a sensor is read next, and a sensor is never read again
+    before its conversion finished. A sensor that stops answering is left out and re-probed
+    every RETRY_INTERVAL s, so it costs one NACK per retry instead of one per pass.
+    setup(sensor) is called whenever a sensor is found, including after it came back or a
+    streaming read showed it lost its pointer (a power cycled sensor has lost its limits and
+    resolution too)."""
+
+    ADDRESSES = tuple(range(0x18, 0x20))
+    RETRY_INTERVAL = 30.0
+
+    def __init__(self, bus=None, addresses=ADDRESSES, setup=None, streaming=False):
+        # one bus shared by all sensors
+        self.bus = bus if bus is not None else InstrumentedSMBus(1, name='mcp9808')
+        self.addresses = tuple(addresses)
+        self.setup = setup
+        self.streaming = streaming  # see MCP9808, one 2-byte read per sensor read
+        self.sensors = {}  # address -> MCP9808, the ones found by probe()
+        self.lost = set()  # addresses that stopped answering
+        self.due = {}  # address -> time.monotonic() of the next read (or re-probe when lost)
+        self.read_at = {}  # address -> time.monotonic() of the last read
+
+    def probe(self):
+        """Look for a sensor at every address, returns the addresses found."""
+        self.sensors = {}
+        self.lost = set()
+        self.due = {}
+        self.read_at = {}
+        for address in self.addresses:
+            sensor = MCP9808(address, bus=self.bus, streaming=self.streaming)
+            if sensor.probe():
+                if self.setup is not None:
+                    self.setup(sensor)
+                self.sensors[address] = sensor
+        return list(self.sensors)
+
+    def read_all(self, force=False):
+        """One pass over the sensors that are due.
+        force: read every answering sensor whose conversion has finished, due or not (e.g. on ALERT)
+        Returns {address: (temperature, flags)} like read_temperature_flags() for the sensors read,
+        None for one that was lost in this pass or is still lost. Sensors not due are left out."""
+        now = time.monotonic()
+        readings = {}
+        for address, sensor in self.sensors.items():
+            recovered = address in self.lost
+            due = self.due.get(address, 0.0)
+            if force and not recovered:
+                due = min(due, self.read_at.get(address, 0.0) + sensor.conversion_time)
+            if now < due:
+                continue
+            readings[address] = None
+            if recovered:
+                if not sensor.probe():
+                    self.due[address] = now + self.RETRY_INTERVAL
+                    continue
+                print(f"MCP9808 at 0x{address:02X} is back")
+                self.lost.discard(address)
+            try:
+                if recovered and self.setup is not None:
+                    self.setup(sensor)
+                readings[address] = sensor.read_temperature_flags()
+                if sensor.pointer_lost:
+                    # the chip was reset under us, the reading itself came from a full read
+                    sensor.pointer_lost = False
+                    if self.setup is not None:
+                        print(f"MCP9808 at 0x{address:02X} was reset, setting it up again")
+                        self.setup(sensor)
+                self.read_at[address] = now
+                self.due[address] = now + sensor.conversion_time  # until schedule() says otherwise
+            except OSError as e:
+                print(f"MCP9808 at 0x{address:02X} stopped answering: {e}")
+                self.lost.add(address)
+                self.due[address] = now + self.RETRY_INTERVAL
+        return readings
+
+    def schedule(self, address, interval):
+        """Read this sensor again interval s after its last read, never before its conversion finished."""
+        sensor = self.sensors[address]
+        self.due[address] = self.read_at.get(address, time.monotonic()) + max(interval, sensor.conversion_time)
+
+    def next_due(self):
+        """time.monotonic() at which the next sensor is due."""
+        return min(self.due.values(), default=time.monotonic() + self.RETRY_INTERVAL)
+
+
+class AdaptiveSampler:
+    """Picks the MCP9808 resolution and the wait before the next read.
+    Close to the trip point, or heading there fast, it samples quickly, switching to coarse
+    resolution (short conversions) when the temperature climbs fast enough for that to pay off;
+    when the temperature is far away and steady it samples slowly at full resolution.
+    The wait is never shorter than a conversion at the chosen resolution, nor than the time the
+    temperature needs to move one resolution step at the current rate (up to MAX_FLOOR)."""
+
+    # read interval in s from urgent to relaxed
+    INTERVALS = (0.1, 0.5, 2.0, 5.0)
+    # tier i is used while the margin to the trip is under MARGINS[i] °C or the trip is under ETAS[i] s away
+    MARGINS = (1.0, 3.0, 6.0)
+    ETAS = (10.0, 60.0, 300.0)
+    MIN_RATE = 0.01  # °C/s assumed when steady or cooling, keeps the resolution choice finite
+    MAX_FLOOR = 2.0  # s, the wait floor near the trip never goes above the old fixed schedule
+
+    def __init__(self, trip, smoothing=0.3):
+        self.trip = trip
+        self.smoothing = smoothing  # weight of the newest slope in the rate estimate
+        self.rate = 0.0  # °C per second, smoothed
+        self.tier = len(self.INTERVALS) - 1
+        self._last = None  # (time, temperature) of the previous reading
+
+    def update(self, temperature, now):
+        """Feed a reading taken at time.monotonic() now, returns (resolution, interval)."""
+        if self._last is not None and now > self._last[0]:
+            slope = (temperature - self._last[1]) / (now - self._last[0])
+            self.rate += (slope - self.rate) * self.smoothing
+        self._last = (now, temperature)
+
+        margin = self.trip - temperature
+        eta = margin / self.rate if self.rate > 0 else float('inf')
+        wanted = len(self.INTERVALS) - 1
+        for i, (margin_limit, eta_limit) in enumerate(zip(self.MARGINS, self.ETAS)):
+            if margin < margin_limit or eta < eta_limit:
+                wanted = i
+                break
+        # tighten straight away, relax one tier per reading so a noisy reading cannot flap it
+        self.tier = min(wanted, self.tier + 1)
+        interval = self.INTERVALS[self.tier]
+
+        # the resolution that spots a crossing soonest at the current rate: a reading lags by about a
+        # conversion, plus the time to climb one step, plus half the wait between reads. Rising slowly
+        # that favours fine steps, rising fast the short coarse conversions win.
+        # Reading again before the temperature can have moved one step only costs bus time, so the
+        # wait is at least the time to climb one step (capped at MAX_FLOOR): hovering at the trip or
+        # creeping past it samples like the fixed schedule, not every 0.1 s
+        rate = max(self.rate, self.MIN_RATE)
+        best = None
+        for resolution, (_, conversion) in MCP9808.RESOLUTIONS.items():
+            wait = max(interval, conversion, min(resolution / rate, self.MAX_FLOOR))
+            lag = conversion + resolution / rate + wait / 2
+            if best is None or lag < best[0]:
+                best = (lag, resolution, wait)
+        return best[1], best[2]
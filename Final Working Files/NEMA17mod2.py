@@ -1,70 +1,237 @@
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO  # only for GPIO.cleanup() in __main__, the driver writes through its backend
+except ImportError:
+    GPIO = None  # off the Pi, pass gpio=GpiodBackend(...)
 import time
+import ctypes
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import numpy as np
+from gpiobackendmod import RPiGPIOBackend
 
 
 '''
 this version includes minor changes from mod1
 - redefined sleep function to set ALL motor pins LOW
+- steps run on absolute deadlines (hybrid sleep + spin) with running lateness statistics
+- trapezoidal / S-curve speed ramps from precomputed step-interval tables
+- bounded moves (steps, degrees or seconds) that return the steps executed, can be queued
+  with move_async() and stopped at a step boundary with stop()
+- one half-step phase table of coil bitmasks, a phase counter that moves by +/-1 (half) or
+  +/-2 (full) per step, and one GPIO write per step
+- pins go through a backend from gpiobackendmod (RPi.GPIO by default, or libgpiod with
+  all coils set in one ioctl)
+- step counter, rotor position, phase and rolling measured RPM in a MotorTelemetry block
+  that other processes can read without messaging the motor (see read_telemetry)
+- StepScheduler drives several Nema17s from one timing loop (heap of next-step deadlines)
 '''
 
 
+STEPS_PER_REV = {'Full': 200, 'Half': 400}
+PHASE_STRIDE = {'Full': 2, 'Half': 1}  # phase counter moves in half steps
+DIRECTION_SIGN = {'CW': 1, 'CCW': -1}
+
+# coil bitmasks, read left to right as A1 B1 A2 B2
+A1_BIT, B1_BIT, A2_BIT, B2_BIT = 0b1000, 0b0100, 0b0010, 0b0001
+# walking it forwards turns CW, backwards CCW. Full steps are the even (two coil) entries
+HALF_STEP_PHASES = (0b0011, 0b0010, 0b0110, 0b0100, 0b1100, 0b1000, 0b1001, 0b0001)
+
+
+@lru_cache(maxsize=64)
+def ramp_intervals(start_rpm, target_rpm, accel, mode='Full', profile='trapezoid'):
+    '''
+    Step intervals (ns, int64 array) that take the motor from start_rpm to target_rpm
+    accel (float) : RPM per second, average over the ramp
+    mode (str) : 'Full' or 'Half', sets the steps per revolution
+    profile (str) : 'trapezoid' for constant acceleration,
+                    's-curve' for a smoothstep speed curve (no jerk at either end, peak accel 1.5x)
+    Works for slowing down too. Cached on all arguments, the arrays are read-only.
+    '''
+    ramp_s = abs(target_rpm - start_rpm) / accel
+    steps_per_rev = STEPS_PER_REV[mode]
+    if ramp_s == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # sample the speed curve finely, integrate it to position and read off when each step is due
+    samples = max(1000, int(4 * max(start_rpm, target_rpm) * steps_per_rev / 60 * ramp_s))
+    t = np.linspace(0.0, ramp_s, samples)
+    u = t / ramp_s
+    if profile == 's-curve':
+        u = u * u * (3 - 2 * u)
+    elif profile != 'trapezoid':
+        raise ValueError(f'unknown ramp profile: {profile}')
+    steps_per_s = (start_rpm + (target_rpm - start_rpm) * u) * steps_per_rev / 60
+    position = np.concatenate([[0.0], np.cumsum((steps_per_s[1:] + steps_per_s[:-1]) / 2 * np.diff(t))])
+
+    step_times = np.interp(np.arange(1, int(position[-1]) + 1), position, t)
+    intervals = np.diff(np.concatenate([[0.0], step_times]))
+    intervals = np.round(intervals * 1e9).astype(np.int64)
+    intervals.setflags(write=False)
+    return intervals
+
+
+def wait_until(deadline_ns, spin_ns):
+    '''
+    Hybrid wait for an absolute time.perf_counter_ns() deadline:
+    sleep until spin_ns before it, then spin. Returns how late we were in ns.
+    '''
+    remaining = deadline_ns - time.perf_counter_ns()
+    if remaining > spin_ns:
+        time.sleep((remaining - spin_ns) / 1e9)
+    now = time.perf_counter_ns()
+    while now < deadline_ns:
+        now = time.perf_counter_ns()
+    return now - deadline_ns
+
+
+class MotorTelemetry(ctypes.Structure):
+    '''
+    Written by the stepping loop, read by anyone. Put it in shared memory with
+    multiprocessing.Value(MotorTelemetry, lock=False) and assign it to Nema17.telemetry.
+    seq is a seqlock counter: odd while a step is being written, see read_telemetry()
+    '''
+    _fields_ = [
+        ('seq', ctypes.c_uint64),
+        ('steps', ctypes.c_uint64),  # every step taken, never goes down
+        ('position', ctypes.c_int64),  # in half steps, CW positive
+        ('phase', ctypes.c_int),  # index into HALF_STEP_PHASES
+        ('rpm', ctypes.c_double),  # rolling measured speed
+        ('last_step_ns', ctypes.c_int64),  # time.perf_counter_ns() of the last step, system wide on Linux
+    ]
+
+
+TELEMETRY_SMOOTHING = 1 / 16  # weight of the newest step interval in the rolling RPM
+SEQLOCK_RETRIES = 100  # seqlock reads give up after this many tries, the writer may have died mid-write
+
+
+def read_telemetry(telemetry, stale_s=0.5):
+    '''
+    Consistent copy of a MotorTelemetry block as a dict, retries while a step is being written
+    rpm reads 0 once no step has been taken for stale_s seconds
+    if the writer was killed between the two seq updates (terminate()) the retries run out and
+    the last copy is returned with 'consistent' False instead of spinning forever
+    '''
+    for _ in range(SEQLOCK_RETRIES):
+        seq = telemetry.seq
+        snapshot = {
+            'steps': telemetry.steps,
+            'position': telemetry.position,
+            'phase': telemetry.phase,
+            'rpm': telemetry.rpm,
+            'last_step_ns': telemetry.last_step_ns,
+        }
+        if seq % 2 == 0 and telemetry.seq == seq:
+            snapshot['consistent'] = True
+            break
+        time.sleep(0)  # let the writer finish the step
+    else:
+        snapshot['consistent'] = False
+    if time.perf_counter_ns() - snapshot['last_step_ns'] > stale_s * 1e9:
+        snapshot['rpm'] = 0.0
+    snapshot['angle'] = snapshot['position'] % STEPS_PER_REV['Half'] * 360 / STEPS_PER_REV['Half']
+    return snapshot
+
+
+class StepTimingStats:
+    '''
+    Running statistics of how late each step hit its deadline (Welford, nothing stored per step)
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = 0
+        self.resyncs = 0  # times the schedule fell a whole step behind and was re-anchored
+        self.mean_late_ns = 0.0
+        self._m2 = 0.0
+        self.max_late_ns = 0
+        self.first_ns = None
+        self.last_ns = None
+
+    def add(self, late_ns, now_ns):
+        self.steps += 1
+        delta = late_ns - self.mean_late_ns
+        self.mean_late_ns += delta / self.steps
+        self._m2 += delta * (late_ns - self.mean_late_ns)
+        self.max_late_ns = max(self.max_late_ns, late_ns)
+        if self.first_ns is None:
+            self.first_ns = now_ns
+        self.last_ns = now_ns
+
+    @property
+    def std_late_ns(self):
+        return (self._m2 / (self.steps - 1)) ** 0.5 if self.steps > 1 else 0.0
+
+    def step_rate(self):
+        # measured steps per second between the first and the last step
+        if self.steps < 2 or self.last_ns == self.first_ns:
+            return 0.0
+        return (self.steps - 1) * 1e9 / (self.last_ns - self.first_ns)
+
+    def summary(self, steps_per_rev=200):
+        return {
+            'steps': self.steps,
+            'measured_rpm': self.step_rate() * 60 / steps_per_rev,
+            'mean_late_us': self.mean_late_ns / 1000,
+            'std_late_us': self.std_late_ns / 1000,
+            'max_late_us': self.max_late_ns / 1000,
+            'resyncs': self.resyncs,
+        }
+
+
 class Nema17:
-    def __init__(self, A1_pin, A2_pin, B1_pin, B2_pin, sleep_pin):
+    # time.sleep overshoots by roughly 0.1 ms on the Pi, so the last stretch before a deadline is spun
+    SPIN_NS = 200000
+    START_RPM = 1.0  # speed a cold start ramps up from
+
+    def __init__(self, A1_pin, A2_pin, B1_pin, B2_pin, sleep_pin, gpio=None):
+        '''
+        gpio : backend from gpiobackendmod, RPiGPIOBackend() if not given
+        '''
         self.A1 = A1_pin
         self.A2 = A2_pin
         self.B1 = B1_pin
         self.B2 = B2_pin
         self.sleep_pin = sleep_pin
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup([self.A1, self.A2, self.B1, self.B2, self.sleep_pin], GPIO.OUT)
+        self.stats = StepTimingStats()
+        self.steps_per_rev = 200  # of the mode currently running, 400 for half steps
+        self.accel = 60.0  # RPM per second for ramps, None jumps straight to speed
+        self.profile = 'trapezoid'  # or 's-curve'
+        self.target_rpm = None  # set_speed() changes this while the motor runs
+        self.current_rpm = 0.0  # speed of the last step, follows the ramps
+        self.phase = 0  # index into HALF_STEP_PHASES of the coils now energised, survives reversals
+        self.coil_pins = [self.A1, self.B1, self.A2, self.B2]
+        self.gpio = gpio if gpio is not None else RPiGPIOBackend()
+        self.gpio.setup([self.A1, self.A2, self.B1, self.B2, self.sleep_pin])
+        # pin states for every phase, precompiled for the backend so a step is a lookup and one write
+        self.phase_levels = [tuple(1 if mask & bit else 0 for bit in (A1_BIT, B1_BIT, A2_BIT, B2_BIT))
+                             for mask in HALF_STEP_PHASES]
+        self.phase_writes = [self.gpio.compile(self.coil_pins, levels) for levels in self.phase_levels]
+        all_pins = [self.A1, self.A2, self.B1, self.B2, self.sleep_pin]
+        self._sleep_write = self.gpio.compile(all_pins, [0, 0, 0, 0, 0])
+        self._wake_write = self.gpio.compile(all_pins, [0, 0, 0, 0, 1])
+        self._generation = 0  # stop() bumps this, every move started before it ends at the next step
+        self._executor = None  # one worker thread, runs move_async() moves in order
+        self.telemetry = MotorTelemetry()  # swap for a shared one to read it from other processes
+        self._interval_avg = None
         self.sleep()  # Start in sleep mode
 
     def sleep(self):
-        GPIO.output([self.A1, self.A2, self.B1, self.B2, self.sleep_pin], GPIO.LOW)
+        self.gpio.write(self._sleep_write)
 
     def wake(self):
-        GPIO.output([self.A1, self.A2, self.B1, self.B2, self.sleep_pin], [0, 0, 0, 0, 1])
+        self.gpio.write(self._wake_write)
 
     def sleep_main_motor(self):
-        GPIO.output([self.A1, self.A2, self.B1, self.B2, self.sleep_pin], GPIO.LOW)
-
-
-
-    full_step_ccw = [
-        [1, 0, 0, 1],
-        [1, 1, 0, 0],
-        [0, 1, 1, 0],
-        [0, 0, 1, 1]
-    ]
+        self.gpio.write(self._sleep_write)
 
-    full_step = [
-        [0, 0, 1, 1],
-        [0, 1, 1, 0],
-        [1, 1, 0, 0],
-        [1, 0, 0, 1]
-    ]
+    def close(self):
+        # Sleep the driver and give the pins back to the backend
+        self.sleep()
+        self.gpio.close()
 
-    half_step = [
-        [0, 0, 1, 1],
-        [0, 0, 1, 0],
-        [0, 1, 1, 0],
-        [0, 1, 0, 0],
-        [1, 1, 0, 0],
-        [1, 0, 0, 0],
-        [1, 0, 0, 1],
-        [0, 0, 0, 1]
-    ]
 
-    half_step_ccw = [
-        [0, 0, 0, 1], 
-        [1, 0, 0, 1],
-        [1, 0, 0, 0],
-        [1, 1, 0, 0],
-        [0, 1, 0, 0],
-        [0, 1, 1, 0],
-        [0, 0, 1, 0],
-        [0, 0, 1, 1]
-    ]
 
     def step_helper_v1(self, step, delay):
         '''
@@ -72,14 +239,11 @@ class Nema17:
         step (pos arg) : list, len = 4
         delay (float) : time between each GPIO update
         '''
-        GPIO.output(self.A1, step[0])
-        time.sleep(delay)
-        GPIO.output(self.B1, step[1])
-        time.sleep(delay)
-        GPIO.output(self.A2, step[2])
-        time.sleep(delay)
-        GPIO.output(self.B2, step[3])
-        time.sleep(delay)
+        # one pin per write through the backend, so it also works on GpiodBackend's claimed lines
+        # released coils first, so A1+A2 or B1+B2 are never on together between two pin writes
+        for pin, level in sorted(zip(self.coil_pins, step), key=lambda pin_level: 1 if pin_level[1] else 0):
+            self.gpio.write(self.gpio.compile([pin], [level]))
+            time.sleep(delay)
 
     def step_helper_v2(self, step, delay):
         '''
@@ -87,34 +251,184 @@ class Nema17:
         step (pos arg) : list, len = 4
         delay (float) : time between each each step in the sequence
         '''
-        GPIO.output([self.A1, self.A2, self.B1, self.B2], step)
+        self.gpio.write(self.gpio.compile([self.A1, self.A2, self.B1, self.B2], step))
         time.sleep(delay)
 
-    def rotate_full_step(self, rpm=10):
-        delay = (60/(200 * rpm))/4 # 60 seconds per minute, 200 steps per revolution
-        # if using step_helper_v2, use 60/(200 * rpm)
-        #start_time = time.time()
-        while True:
-            for step in self.full_step:
-                self.step_helper_v1(step, delay)
+    def set_coils(self, step):
+        '''
+        Write one step to the coils with a single backend write, no delays
+        step (pos arg) : list, len = 4, in A1, B1, A2, B2 order like step_helper_v1
+        '''
+        self.gpio.write(self.gpio.compile(self.coil_pins, step))
 
-    def rotate_full_step_ccw(self, rpm):
-        delay = 60/(200 * rpm * 4) # 60 seconds per minute, 200 steps per revolution
-        while True:
-            for step in self.full_step_ccw:
-                self.step_helper_v1(step, delay)
+    def wait_until(self, deadline_ns):
+        return wait_until(deadline_ns, self.SPIN_NS)
 
-    def rotate_half_step(self, rpm):
-        delay = 60/(400 * rpm * 4) # 60 seconds per minute, 400 steps per revolution
-        while True:
-            for step in self.half_step:
-                self.step_helper_v1(step, delay)
+    def set_speed(self, rpm):
+        # Change the speed of the running motor, it ramps there at self.accel
+        self.target_rpm = rpm
+
+    def ramp_down(self):
+        '''
+        Slow the running loop to START_RPM ahead of a reversal, call it at every step boundary
+        returns True once the motor is there (straight away without ramps), reversing from
+        full speed would stall it
+        '''
+        if not self.accel:
+            return True
+        self.set_speed(self.START_RPM)
+        return self.current_rpm <= self.START_RPM * 1.01
 
-    def rotate_half_step_ccw(self, rpm):
-        delay = 60/(400 * rpm * 4) # 60 seconds per minute, 400 steps per revolution
+    def step_intervals(self, rpm, mode, start_rpm=None):
+        '''
+        Generator of step intervals in ns: a ramp from start_rpm to the target, then cruise.
+        The target (set_speed) is re-read every step, so a change starts a new ramp from the current speed.
+        rpm only sets the default start, call set_speed(rpm) first.
+        '''
+        steps_per_rev = STEPS_PER_REV[mode]
+        current = start_rpm if start_rpm is not None else min(rpm, self.START_RPM)
         while True:
-            for step in self.half_step_ccw:
-                self.step_helper_v1(step, delay)
+            target = self.target_rpm
+            if self.accel:
+                # round the start so retunes land on cached tables
+                for interval in ramp_intervals(round(current, 1), target, self.accel, mode, self.profile):
+                    yield int(interval)
+                    if self.target_rpm != target:
+                        current = 60e9 / (steps_per_rev * interval)
+                        break
+                else:
+                    current = target
+                if self.target_rpm != target:
+                    continue
+            cruise_ns = int(60e9 / (steps_per_rev * target))  # 60 seconds per minute
+            while self.target_rpm == target:
+                yield cruise_ns
+            current = target
+
+    def rotate(self, rpm, direction='CW', mode='Full', start_rpm=None, steps=None, duration=None, generation=None, check=None):
+        '''
+        Step in direction ('CW'/'CCW') and mode ('Full'/'Half'), ramping from start_rpm (START_RPM by default) to rpm
+        every step has a precomputed absolute deadline (previous deadline + interval), so sleep
+        overshoot and GPIO write time do not add up. If a step is more than a whole interval late the
+        schedule is re-anchored instead of bursting steps to catch up, which would stall the motor.
+        steps (int) : stop after this many steps, slowing down at the end
+        duration (float) : stop after this many seconds
+        check (callable) : called at every step boundary, returning True ends the run
+        Without any of them it runs until stop(). Returns the number of steps executed.
+        '''
+        if generation is None:
+            generation = self._generation
+        stride = DIRECTION_SIGN[direction] * PHASE_STRIDE[mode]
+        # coming from a one coil half step, the first full step is a half step
+        step = stride // 2 if mode == 'Full' and self.phase % 2 else stride
+        self.steps_per_rev = STEPS_PER_REV[mode]
+        self.stats.reset()
+        decel_at = None
+        if steps is not None and self.accel:
+            # start slowing down when the remaining steps match the length of the stopping ramp
+            decel_steps = len(ramp_intervals(round(float(rpm), 1), self.START_RPM, self.accel, mode, self.profile))
+            decel_at = steps - min(decel_steps, steps // 2)
+        self._interval_avg = None  # rolling step interval in ns, restarted every run
+        self.set_speed(rpm)
+        intervals = self.step_intervals(rpm, mode, start_rpm)
+        write = self.gpio.write
+        phase_writes = self.phase_writes
+        deadline = time.perf_counter_ns()
+        end = deadline + int(duration * 1e9) if duration is not None else None
+        done = 0
+        while self._generation == generation:
+            if steps is not None and done >= steps:
+                break
+            if end is not None and deadline > end:
+                break
+            if check is not None and check():
+                break
+            if done == decel_at:
+                self.set_speed(self.START_RPM)
+            phase = (self.phase + step) % 8
+            late = self.wait_until(deadline)
+            write(phase_writes[phase])
+            done += 1
+            now = deadline + late
+            self.stats.add(late, now)
+            self.publish_step(phase, step, stride, now, done > 1)
+            step = stride
+
+            interval = next(intervals)
+            self.current_rpm = 60e9 / (self.steps_per_rev * interval)
+            deadline += interval
+            if late > interval:
+                deadline += late  # next step one interval after this one
+                self.stats.resyncs += 1
+        return done
+
+    def publish_step(self, phase, step, stride, now, running):
+        '''
+        Record a step that just went out: new phase, telemetry and rolling RPM
+        step (int) : half steps moved, signed. stride : half steps per step of the current mode
+        running (bool) : False for the first step of a run, which has no interval to measure
+        '''
+        telemetry = self.telemetry
+        self.phase = phase
+        if running:
+            step_ns = now - telemetry.last_step_ns
+            if self._interval_avg is None:
+                self._interval_avg = step_ns
+            else:
+                self._interval_avg += (step_ns - self._interval_avg) * TELEMETRY_SMOOTHING
+        telemetry.seq += 1
+        telemetry.steps += 1
+        telemetry.position += step
+        telemetry.phase = phase
+        if self._interval_avg:
+            telemetry.rpm = 60e9 * abs(stride) / (STEPS_PER_REV['Half'] * self._interval_avg)
+        telemetry.last_step_ns = now
+        telemetry.seq += 1
+
+    def move(self, steps=None, degrees=None, duration=None, rpm=10, direction='CW', mode='Full', generation=None):
+        '''
+        Bounded move, blocks until it is done or stopped
+        steps (int) / degrees (float) / duration (float, s) : how far to go, give one of them
+        Returns the number of steps executed.
+        '''
+        if degrees is not None:
+            steps = round(abs(degrees) * STEPS_PER_REV[mode] / 360)
+        if steps is None and duration is None:
+            raise ValueError('move needs steps, degrees or duration')
+        return self.rotate(rpm, direction, mode, steps=steps, duration=duration, generation=generation)
+
+    def move_async(self, **kwargs):
+        '''
+        Queue a move() on the motor's worker thread and return right away
+        Moves run one after another in the order queued. Returns a Future,
+        .result() gives the steps executed (0 if stop() was called before it started).
+        '''
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='nema17')
+        kwargs['generation'] = self._generation
+        return self._executor.submit(self.move, **kwargs)
+
+    def stop(self):
+        # Ends the running move at its next step boundary and drops the queued ones, coils keep their state
+        self._generation += 1
+
+    def timing_report(self):
+        summary = self.stats.summary(self.steps_per_rev)
+        return (f"{summary['steps']} steps at {summary['measured_rpm']:.2f} RPM measured, "
+                f"late by {summary['mean_late_us']:.1f} us mean / {summary['std_late_us']:.1f} us std / "
+                f"{summary['max_late_us']:.1f} us max, {summary['resyncs']} resyncs")
+
+    def rotate_full_step(self, rpm=10, start_rpm=None):
+        return self.rotate(rpm, 'CW', 'Full', start_rpm) # 200 steps per revolution
+
+    def rotate_full_step_ccw(self, rpm, start_rpm=None):
+        return self.rotate(rpm, 'CCW', 'Full', start_rpm)
+
+    def rotate_half_step(self, rpm, start_rpm=None):
+        return self.rotate(rpm, 'CW', 'Half', start_rpm) # 400 steps per revolution
+
+    def rotate_half_step_ccw(self, rpm, start_rpm=None):
+        return self.rotate(rpm, 'CCW', 'Half', start_rpm)
 
     def test_stepper(self, sequence, delay = None, rpm = None):
         if rpm is not None:
@@ -125,6 +439,116 @@ class Nema17:
             self.step_helper_v1(step, delay)
 
 
+class StepScheduler:
+    '''
+    Runs several Nema17s from one timing loop instead of one loop (and process) per motor
+    the next-step deadline of every motor sits in a heap, the loop waits for the earliest,
+    steps that motor and pushes its next deadline. Each motor keeps its own speed ramps,
+    phase, telemetry and lateness stats (motor.stats), and can be retuned while running
+    with set_motor() or motor.set_speed().
+    '''
+    SPIN_NS = Nema17.SPIN_NS
+
+    def __init__(self, motors=()):
+        self.motors = []
+        self.settings = []  # per motor [rpm, direction, mode]
+        self._generation = 0
+        for motor in motors:
+            self.add_motor(motor)
+
+    def add_motor(self, motor, rpm=10, direction='CW', mode='Full'):
+        self.motors.append(motor)
+        self.settings.append([rpm, direction, mode])
+        return len(self.motors) - 1
+
+    def set_motor(self, index, rpm=None, direction=None, mode=None):
+        '''Change one motor, a running loop picks it up at that motor's next step'''
+        settings = self.settings[index]
+        if rpm is not None:
+            settings[0] = rpm
+            self.motors[index].set_speed(rpm)
+        if direction is not None:
+            settings[1] = direction
+        if mode is not None:
+            settings[2] = mode
+
+    def stop(self):
+        # Ends run() at the next step of any motor
+        self._generation += 1
+
+    def run(self, duration=None, check=None):
+        '''
+        Step all motors until stop(), duration seconds, or check() returns True (checked every step)
+        Returns the number of steps executed per motor.
+        '''
+        generation = self._generation
+        motors = self.motors
+        # per motor: interval generator, direction and mode it was set up for, stride and step (half steps),
+        # steps done, slowing down for a reversal
+        axes = []
+        heap = []
+        start = time.perf_counter_ns()
+        for i, motor in enumerate(motors):
+            rpm, direction, mode = self.settings[i]
+            motor.steps_per_rev = STEPS_PER_REV[mode]
+            motor.stats.reset()
+            motor._interval_avg = None
+            stride = DIRECTION_SIGN[direction] * PHASE_STRIDE[mode]
+            step = stride // 2 if mode == 'Full' and motor.phase % 2 else stride
+            motor.set_speed(rpm)
+            axes.append([motor.step_intervals(rpm, mode), direction, mode, stride, step, 0, False])
+            heap.append((start, i))
+        heapq.heapify(heap)
+        end = start + int(duration * 1e9) if duration is not None else None
+
+        while heap and self._generation == generation:
+            deadline, i = heap[0]
+            if end is not None and deadline > end:
+                break
+            if check is not None and check():
+                break
+            motor = motors[i]
+            axis = axes[i]
+            rpm, direction, mode = self.settings[i]
+            if axis[6] and direction == axis[1]:
+                axis[6] = False  # reversal called off before the bottom of the ramp, back up to speed
+                motor.set_speed(rpm)
+            if direction != axis[1] and not motor.ramp_down():
+                axis[6] = True  # keep going the old way until it is down at START_RPM
+            elif direction != axis[1] or mode != axis[2]:
+                # retuned: new stride, mode changes also need a new interval generator
+                if direction != axis[1]:
+                    axis[6] = False
+                    motor.set_speed(rpm)  # reversed at the bottom of the ramp, speed up again
+                if mode != axis[2]:
+                    axis[0] = motor.step_intervals(rpm, mode, motor.current_rpm or None)
+                    motor.steps_per_rev = STEPS_PER_REV[mode]
+                axis[1], axis[2] = direction, mode
+                axis[3] = DIRECTION_SIGN[direction] * PHASE_STRIDE[mode]
+                axis[4] = axis[3] // 2 if mode == 'Full' and motor.phase % 2 else axis[3]
+
+            phase = (motor.phase + axis[4]) % 8
+            late = wait_until(deadline, self.SPIN_NS)
+            motor.gpio.write(motor.phase_writes[phase])
+            axis[5] += 1
+            now = deadline + late
+            motor.stats.add(late, now)
+            motor.publish_step(phase, axis[4], axis[3], now, axis[5] > 1)
+            axis[4] = axis[3]
+
+            interval = next(axis[0])
+            motor.current_rpm = 60e9 / (motor.steps_per_rev * interval)
+            deadline += interval
+            if late > interval:
+                deadline += late
+                motor.stats.resyncs += 1
+            heapq.heapreplace(heap, (deadline, i))
+        return [axis[5] for axis in axes]
+
+    def timing_report(self):
+        return {f'motor {i}': motor.stats.summary(motor.steps_per_rev) for i, motor in enumerate(self.motors)}
+
+
 if __name__ == "__main__":
 
     #GPIO.cleanup()
@@ -139,7 +563,7 @@ if __name__ == "__main__":
     stepper.wake()
     
     try:
-        #stepper.test_stepper(stepper.full_step, delay = 1e-3, rpm = None)
+        #stepper.test_stepper([stepper.phase_levels[p] for p in range(0, 8, 2)], delay = 1e-3, rpm = None)
         stepper.rotate_half_step(15)
         #stepper.rotate_half_step(40)
         #stepper.rotate_full_step_ccw(10)
@@ -147,8 +571,11 @@ if __name__ == "__main__":
         
     except KeyboardInterrupt:
         print("\nMeasurement stopped by user")
+        print(stepper.timing_report())
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        GPIO.cleanup()
+        stepper.close()
+        if GPIO is not None:
+            GPIO.cleanup()
         print('cleaned up pins.')
\ No newline at end of file
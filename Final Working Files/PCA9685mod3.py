@@ -1,7 +1,74 @@
-import smbus2
+from smbusmod import InstrumentedSMBus
 import time
 import random
 import math
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+
+class WaveformCache:
+    '''
+    Ready-to-write 12-bit duty tables for the animated effects, built once per (shape, steps)
+    duty values follow PCA9685Controller.duty_to_pwm: 0 is the full-off bit, 4096 the full-on bit
+    shapes:
+        'sine'        : (sin(i*pi/steps) + 1) / 2 for i in range(steps)
+        'breathe'     : 'sine' up and back down, 2*steps entries
+        'pulse'       : sin(i*pi/steps), dark at both ends
+        'hue'         : full-saturation color wheel, shape (steps, 3) for r, g, b
+        'hue_breathe' : color wheel scaled by 'sine'
+    '''
+
+    def __init__(self):
+        self._tables = {}
+
+    def get(self, shape, steps):
+        key = (shape, steps)
+        table = self._tables.get(key)
+        if table is None:
+            table = self._build(shape, steps)
+            table.setflags(write=False)
+            self._tables[key] = table
+        return table
+
+    def _build(self, shape, steps):
+        i = np.arange(steps)
+        if shape == 'sine':
+            return self.brightness_to_duty((np.sin(i * np.pi / steps) + 1) / 2 * 100)
+        if shape == 'breathe':
+            i = np.concatenate([i, np.arange(steps, 0, -1)])
+            return self.brightness_to_duty((np.sin(i * np.pi / steps) + 1) / 2 * 100)
+        if shape == 'pulse':
+            return self.brightness_to_duty(np.sin(i * np.pi / steps) * 100)
+        if shape in ('hue', 'hue_breathe'):
+            rgb = np.floor(self.hue_to_rgb(i / steps) * 255)
+            if shape == 'hue_breathe':
+                rgb = rgb * ((np.sin(i * np.pi / steps) + 1) / 2)[:, None]
+            # same scaling as RGBLED.set_color(r * 100 / 255, ...) -> LED.set_rgb_brightness
+            value = rgb * 100 / 255
+            return np.where(value <= 0, 0, np.floor(value * 4095 / 100)).astype(np.uint16)
+        raise ValueError(f'unknown waveform shape: {shape}')
+
+    @staticmethod
+    def brightness_to_duty(brightness):
+        # vectorised PCA9685Controller.brightness_to_pwm
+        duty = np.floor(np.clip(brightness, 0, 100) * 4095 / 100)
+        duty = np.where(brightness <= 0, 0, np.where(brightness >= 100, 4096, duty))
+        return duty.astype(np.uint16)
+
+    @staticmethod
+    def hue_to_rgb(hue):
+        # vectorised hsv_to_rgb(h, 1, 1), returns an (n, 3) array of 0-1 floats
+        sector = np.floor(hue * 6.0)
+        f = hue * 6.0 - sector
+        sector = sector.astype(int) % 6
+        one = np.ones_like(f)
+        zero = np.zeros_like(f)
+        q = 1.0 - f
+        r = np.choose(sector, [one, q, zero, zero, f, one])
+        g = np.choose(sector, [f, one, one, q, zero, zero])
+        b = np.choose(sector, [zero, zero, f, one, one, q])
+        return np.stack([r, g, b], axis=1)
 
 
 class PCA9685Controller:
@@ -11,11 +78,27 @@ class PCA9685Controller:
     LED0_ON_H = 0x07                                                                                                                                                                                                                                                                                                 
     LED0_OFF_L = 0x08
     LED0_OFF_H = 0x09
+    ALL_LED_ON_L = 0xFA  # ALL_LED_ON_L/H, ALL_LED_OFF_L/H (0xFA-0xFD) drive every channel at once
     PRESCALE = 0xFE
 
-    def __init__(self, i2c_bus=1, address=0x40):
-        self.bus = smbus2.SMBus(i2c_bus)
+    # SMBus block transfers carry at most 32 data bytes, i.e. 8 channels of 4 registers
+    MAX_BLOCK_BYTES = 32
+    CHANNELS_PER_BLOCK = MAX_BLOCK_BYTES // 4
+    NUM_CHANNELS = 16
+    FRAME_RATE = 30  # default target fps for animated effects, the PWM itself runs at 50 Hz
+
+    def __init__(self, i2c_bus=1, address=0x40, bus=None):
+        # bus: optional already open bus object (e.g. a shared InstrumentedSMBus)
+        self.bus = bus if bus is not None else InstrumentedSMBus(i2c_bus, name='pca9685')
         self.address = address
+        self._pending = {}  # channel -> (on, off) waiting for the next flush
+        self._frame_depth = 0
+        # copy of what the chip registers hold, None until the channel is first written
+        self.shadow = [None] * self.NUM_CHANNELS
+        self.skipped_writes = 0  # channels dropped by flush() because the chip already had them
+        self.last_frame_stats = None  # filled in by run_frames()
+        self.cancel_event = threading.Event()  # set to stop the running effect at the next frame boundary
+        self.waveforms = WaveformCache()
         self.initialize()
         self.all_leds = []
 
@@ -32,21 +115,181 @@ class PCA9685Controller:
 
     def set_pwm(self, channel, on, off):
         # Set PWM values for a specific channel
-        reg_base = self.LED0_ON_L + 4 * channel
-        self.bus.write_byte_data(self.address, reg_base, on & 0xFF)
-        self.bus.write_byte_data(self.address, reg_base + 1, on >> 8)
-        self.bus.write_byte_data(self.address, reg_base + 2, off & 0xFF)
-        self.bus.write_byte_data(self.address, reg_base + 3, off >> 8)
+        # inside a frame() block the write is held back and sent with the rest of the frame
+        self._pending[channel] = (on, off)
+        if self._frame_depth == 0:
+            self.flush()
+
+    def set_pwm_bulk(self, values):
+        '''
+        Write several channels using auto-increment block transfers
+        values (dict) : channel -> (on, off)
+        runs of consecutive channels go out as one burst, split at the 32 byte SMBus limit
+        '''
+        with self.bus.batch():  # one request to the bus owner when running under busownermod
+            run = []
+            for channel in sorted(values):
+                if run and (channel != run[-1] + 1 or len(run) == self.CHANNELS_PER_BLOCK):
+                    self._write_block(run, values)
+                    run = []
+                run.append(channel)
+            if run:
+                self._write_block(run, values)
+
+    def _write_block(self, channels, values):
+        # channels must be consecutive, relies on the auto-increment bit set in initialize()
+        data = []
+        for channel in channels:
+            on, off = values[channel]
+            data += [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+        self.bus.write_i2c_block_data(self.address, self.LED0_ON_L + 4 * channels[0], data)
+        for channel in channels:
+            self.shadow[channel] = values[channel]
+
+    @contextmanager
+    def frame(self):
+        '''
+        Group every set_pwm inside the with-block into one set of burst writes
+        frames can be nested, the writes go out when the outermost one closes
+        '''
+        self._frame_depth += 1
+        try:
+            yield self
+        finally:
+            self._frame_depth -= 1
+            if self._frame_depth == 0:
+                self.flush()
+
+    def flush(self):
+        # Send the channels that changed since the last flush, unchanged ones never hit the bus
+        if self.bus.batch_errors():
+            # an earlier frame failed on the bus owner after the shadow was updated, so the shadow
+            # holds what the chip should show, not what it does: resend every known channel
+            wanted = {channel: value for channel, value in enumerate(self.shadow) if value is not None}
+            self._pending = {**wanted, **self._pending}
+            self.invalidate()
+        pending, self._pending = self._pending, {}
+        dirty = {channel: value for channel, value in pending.items() if self.shadow[channel] != value}
+        self.skipped_writes += len(pending) - len(dirty)
+        if dirty:
+            self.set_pwm_bulk(dirty)
+
+    def set_all_pwm(self, on, off):
+        '''
+        Set all 16 channels in a single 4-byte write to the ALL_LED registers
+        anything still queued in the current frame is superseded and dropped
+        '''
+        self.bus.write_i2c_block_data(self.address, self.ALL_LED_ON_L,
+                                      [on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+        self._pending = {}
+        self.shadow = [(on, off)] * self.NUM_CHANNELS
+
+    def set_all_brightness(self, brightness):
+        # Global brightness for every channel, 0-100 like LED.set_brightness
+        self.set_all_pwm(*self.brightness_to_pwm(brightness))
+
+    def set_all_off(self):
+        self.set_all_pwm(0, 4096)
+
+    @staticmethod
+    def brightness_to_pwm(brightness):
+        # Convert 0-100 brightness into the (on, off) register pair
+        if brightness <= 0:
+            return (0, 4096)  # full off bit
+        if brightness >= 100:
+            return (4096, 0)  # full on bit
+        return (0, int(brightness * 4095 / 100))
+
+    @staticmethod
+    def duty_to_pwm(duty):
+        # Convert a WaveformCache duty value into the (on, off) register pair
+        duty = int(duty)
+        if duty <= 0:
+            return (0, 4096)
+        if duty >= 4096:
+            return (4096, 0)
+        return (0, duty)
+
+    def sync(self):
+        '''
+        Return once every write sent so far is on the bus
+        under the bus owner writes are fire-and-forget, a read is answered only after the
+        queued writes ahead of it ran, on a direct bus it is just one extra read
+        '''
+        self.bus.read_byte_data(self.address, self.MODE1)
+        return time.monotonic()
+
+    def invalidate(self):
+        # Forget the shadow copy so the next flush rewrites every channel (e.g. after a chip reset)
+        self.shadow = [None] * self.NUM_CHANNELS
+
+    def run_frames(self, render, duration, fps=None):
+        '''
+        Frame engine for animated effects
+        render (callable) : render(t) sets the LEDs for t seconds after the start, every write
+                            it makes goes out as one frame
+        duration (float) : seconds to run for
+        fps (float) : target frame rate, defaults to FRAME_RATE
+        Frames are paced against time.monotonic deadlines so bus time does not add up as drift.
+        When a frame runs late the missed deadlines are dropped instead of rushed.
+        Setting cancel_event ends the effect at the next frame boundary (the wait between
+        frames wakes up straight away).
+        Returns a dict with the frame counts and the fps actually achieved.
+        '''
+        period = 1.0 / (fps or self.FRAME_RATE)
+        start = time.monotonic()
+        end = start + duration
+        deadline = start
+        frames = 0
+        dropped = 0
+        frame_times = []
+        first_frame_at = None
+        first_start = last_start = None  # start of the first and the last frame rendered
+
+        while not self.cancel_event.is_set():
+            now = time.monotonic()
+            if now >= end:
+                break
+            with self.frame():
+                render(now - start)
+            done = time.monotonic()
+            frames += 1
+            if first_start is None:
+                first_start = now
+            last_start = now
+            frame_times.append(done - now)
+            if first_frame_at is None:
+                first_frame_at = self.sync()  # when it was on the bus, not when it was queued
+
+            deadline += period
+            if done > deadline:
+                missed = int((done - deadline) / period) + 1
+                dropped += missed
+                deadline += missed * period
+            self.cancel_event.wait(max(0.0, min(deadline, end) - time.monotonic()))
+
+        elapsed = time.monotonic() - start
+        self.last_frame_stats = {
+            'duration': duration,
+            'elapsed': elapsed,
+            'target_fps': 1.0 / period,
+            # from the frames rendered, a run cut short after a frame or two has no meaningful rate
+            'fps': (frames - 1) / (last_start - first_start) if frames > 1 and last_start > first_start else 0.0,
+            'frames': frames,
+            'dropped': dropped,
+            'cancelled': self.cancel_event.is_set(),
+            'first_frame_at': first_frame_at,  # time.monotonic() when the first frame was on the bus
+            'frame_times': frame_times,
+        }
+        return self.last_frame_stats
 
     def reset(self):
         # Reset all LEDs to 0 brightness
-        for led in self.all_leds:
-            led.set_brightness(0)
+        self.all_off()
 
     def master_off(self):
-        # Set all channels (0-15) to off
-        for channel in range(16):
-            self.set_pwm(channel, 0, 4096)  # 4096 represents fully off for PCA9685
+        # Set all channels (0-15) to off, always sent even if the shadow already says off
+        self.set_all_off()  # one ALL_LED write instead of 16 channel writes
 
     def start_light_show(self, show_name, duration=5):
         self.led_show.start_show(show_name, duration)
@@ -61,16 +304,12 @@ class PCA9685Controller:
             self.controller.all_leds.append(self)
 
         def set_brightness(self, brightness):
-            if brightness <= 0:
-                # Turn off the LED completely
-                self.controller.set_pwm(self.channel, 0, 4096)
-            elif brightness >= 100:
-                # Turn on the LED at full brightness
-                self.controller.set_pwm(self.channel, 4096, 0)
-            else:
-                # Normal case: set PWM duty cycle
-                duty_cycle = int(brightness * 4095 / 100)
-                self.controller.set_pwm(self.channel, 0, duty_cycle)
+            # 0 and 100 use the full off / full on bits, anything between is a PWM duty cycle
+            self.controller.set_pwm(self.channel, *self.controller.brightness_to_pwm(brightness))
+
+        def set_duty(self, duty):
+            # Write a precomputed WaveformCache duty value
+            self.controller.set_pwm(self.channel, *self.controller.duty_to_pwm(duty))
 
 
         def set_rgb_brightness(self, brightness):
@@ -88,44 +327,44 @@ class PCA9685Controller:
                 self.controller.set_pwm(self.channel, 0, duty_cycle)
 
         def breathe(self, duration=15, steps=100):
-            # Create a breathing effect for the LED
-            start = time.time()
-            while (time.time() - start) < duration:
-                for i in range(steps):
-                    brightness = (math.sin(i * math.pi / steps) + 1) / 2 * 100
-                    self.set_brightness(brightness)
-                    time.sleep(duration / (steps * 2))  # Adjusted sleep time
-                for i in range(steps, 0, -1):
-                    brightness = (math.sin(i * math.pi / steps) + 1) / 2 * 100
-                    self.set_brightness(brightness)
-                    time.sleep(duration / (steps * 2))  # Adjusted sleep time
-                
-                if (time.time() - start) >= duration:
-                    break
+            # Create a breathing effect for the LED, one up/down cycle of 2*steps steps over duration
+            table = self.controller.waveforms.get('breathe', steps)
+            def render(t):
+                self.set_duty(table[int(t / duration * len(table)) % len(table)])
+            return self.controller.run_frames(render, duration)
 
         def pulse(self, duration=1, steps=50):
-            # Create a quick pulse effect
-            self.set_brightness(0)
-            time.sleep(duration / 4)
-            for i in range(steps):
-                brightness = math.sin(i * math.pi / steps) * 100
-                self.set_brightness(brightness)
-                time.sleep(duration / (2 * steps))
+            # Create a quick pulse effect: dark for duration/4, then a half sine over duration/2
+            table = self.controller.waveforms.get('pulse', steps)
+            def render(t):
+                i = int((t - duration / 4) / (duration / 2) * steps)
+                self.set_duty(table[i] if 0 <= i < steps else 0)
+            stats = self.controller.run_frames(render, 3 * duration / 4)
             self.set_brightness(0)
+            return stats
 
     class RGBLED:
         def __init__(self, controller, channels):
             # channels is a list [r, g, b]
             # Initialize an RGB LED
+            self.controller = controller
             self.red = controller.LED(controller, channels[0])
             self.green = controller.LED(controller, channels[1])
             self.blue = controller.LED(controller, channels[2])
 
+        def set_color_duty(self, duties):
+            # Write one (r, g, b) row of a WaveformCache color table
+            with self.controller.frame():
+                self.red.set_duty(duties[0])
+                self.green.set_duty(duties[1])
+                self.blue.set_duty(duties[2])
+
         def set_color(self, r, g, b):
             # Set RGB color (0-255 for each component)
-            self.red.set_rgb_brightness(r)
-            self.green.set_rgb_brightness(g)
-            self.blue.set_rgb_brightness(b)
+            with self.red.controller.frame():
+                self.red.set_rgb_brightness(r)
+                self.green.set_rgb_brightness(g)
+                self.blue.set_rgb_brightness(b)
 
         def set_color_hex(self, hex_color):
             # Set RGB color using a hex string
@@ -138,38 +377,35 @@ class PCA9685Controller:
 
         def set_white_brightness(self, brightness):
             # Set brightness for all RGB components from 0-100
-            self.red.set_brightness(brightness)
-            self.green.set_brightness(brightness)
-            self.blue.set_brightness(brightness)
+            with self.red.controller.frame():
+                self.red.set_brightness(brightness)
+                self.green.set_brightness(brightness)
+                self.blue.set_brightness(brightness)
 
         def breathe_single_color(self, hex_color, duration=5, steps=100):
             r, g, b = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
-            for i in range(steps):
-                brightness = ((math.sin(i * math.pi / steps) + 1) / 2) * 255 # set scaled brightness from 0-255
-                self.red.set_brightness(r)
-                self.green.set_brightness(g)
-                self.blue.set_brightness(b)
-                time.sleep(duration / steps)
-
-        def color_cycle(self, duration=10, steps=200):
-            # Cycle through the color wheel
-            for i in range(steps):
-                hue = i / steps
-                r, g, b = [int(x * 255) for x in self.hsv_to_rgb(hue, 1, 1)]
-                self.set_color(r * 100 / 255, g * 100 / 255, b * 100 / 255)
-                time.sleep(duration / steps)
-
-        def breathe_color_wheel(self, duration=10, steps=200):
-            for i in range(steps):
-                hue = i / steps
-                r, g, b = [int(x * 255) for x in self.hsv_to_rgb(hue, 1, 1)]
+            def render(t):
+                i = int(t / duration * steps)
                 brightness = (math.sin(i * math.pi / steps) + 1) / 2
                 self.set_color(
                     r * brightness * 100 / 255,
                     g * brightness * 100 / 255,
                     b * brightness * 100 / 255
                 )
-                time.sleep(duration / steps)
+            return self.controller.run_frames(render, duration)
+
+        def color_cycle(self, duration=10, steps=200):
+            # Cycle through the color wheel
+            table = self.controller.waveforms.get('hue', steps)
+            def render(t):
+                self.set_color_duty(table[int(t / duration * steps) % steps])
+            return self.controller.run_frames(render, duration)
+
+        def breathe_color_wheel(self, duration=10, steps=200):
+            table = self.controller.waveforms.get('hue_breathe', steps)
+            def render(t):
+                self.set_color_duty(table[int(t / duration * steps) % steps])
+            return self.controller.run_frames(render, duration)
 
         @staticmethod
         def hsv_to_rgb(h, s, v):
@@ -196,44 +432,47 @@ class PCA9685Controller:
         
         def rgb_breathe_single_color(self, hex_color, duration=5, steps=100):
             r, g, b = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
-            print('set color')
-            for i in range(steps):
+            def render(t):
+                i = int(t / duration * steps)
                 brightness = (math.sin(i * math.pi / steps) + 1) / 2
-                print(f'brightness set to {brightness}')
-                for rgb_led in self.rgb_leds:
-                    rgb_led.set_color(
-                        r * brightness,
-                        g * brightness,
-                        b * brightness
-                    )
-                    dur1 = time.sleep(0.1)
-                    print(f'slept for {dur1} inside rgb loop')
-                dur2 = 0.5
-                time.sleep(dur2)
-                print(f'slept for {dur2} outside rgb loop')
+                self.set_color(
+                    r * brightness,
+                    g * brightness,
+                    b * brightness
+                )
+            return self.controller.run_frames(render, duration)
+
     class BatchLED:
         def __init__(self, leds):
             self.leds = leds
 
         def set_brightness(self, brightness):
             # Set brightness for all LEDs in the group
-            for led in self.leds:
-                led.set_brightness(brightness)
+            if not self.leds:
+                return
+            with self.leds[0].controller.frame():
+                for led in self.leds:
+                    led.set_brightness(brightness)
 
         def breathe(self, duration=5, steps=100):
             # Create a breathing effect for all LEDs in the group
-            for i in range(steps):
-                brightness = (math.sin(i * math.pi / steps) + 1) / 2 * 100
-                self.set_brightness(brightness)
-                time.sleep(duration / steps)
+            table = self.leds[0].controller.waveforms.get('sine', steps)
+            def render(t):
+                duty = table[int(t / duration * steps) % steps]
+                for led in self.leds:
+                    led.set_duty(duty)
+            return self.leds[0].controller.run_frames(render, duration)
 
         def chase(self, duration=5, steps=20):
-            # Create a chasing effect
-            for _ in range(steps):
-                for led in self.leds:
-                    led.set_brightness(100)
-                    time.sleep(duration / (steps * len(self.leds)))
-                    led.set_brightness(0)
+            # Create a chasing effect, each LED is lit for duration / (steps * len(leds))
+            slot = duration / (steps * len(self.leds))
+            def render(t):
+                lit = int(t / slot) % len(self.leds)
+                for i, led in enumerate(self.leds):
+                    led.set_brightness(100 if i == lit else 0)
+            stats = self.leds[0].controller.run_frames(render, duration)
+            self.set_brightness(0)
+            return stats
 
     def create_led(self, channel):
         return self.LED(self, channel)
@@ -248,12 +487,10 @@ class PCA9685Controller:
         return self.LEDShow(self)
 
     def all_off(self):
-        for led in self.all_leds:
-            led.set_brightness(0)
+        self.set_all_off()
 
     def all_on(self):
-        for led in self.all_leds:
-            led.set_brightness(100)
+        self.set_all_brightness(100)
 
     def sequential_on(self, delay=0.1):
         for led in self.all_leds:
@@ -282,17 +519,26 @@ class PCA9685Controller:
 
         def all_on(self):
             """Turn on all LEDs."""
-            for led in self.blade_leds + self.moss_leds:
-                led.set_brightness(100)
-            for rgb in self.rgb_leds:
-                rgb.set_color_hex('#f23fe3') # default is pink
+            with self.controller.frame():
+                for led in self.blade_leds + self.moss_leds:
+                    led.set_brightness(100)
+                for rgb in self.rgb_leds:
+                    rgb.set_color_hex('#f23fe3') # default is pink
 
         def all_off(self):
             """Turn off all LEDs."""
-            for led in self.blade_leds + self.moss_leds:
-                led.set_brightness(0)
-            for rgb in self.rgb_leds:
-                rgb.set_color(0, 0, 0)
+            # ALL_LED off is one write, then the center LED is put back since it is not part of the show
+            center = self.controller.shadow[self.center_pin]
+            with self.controller.frame():
+                if center is None:
+                    # the center LED was never written so it cannot be put back, clear only the show channels
+                    for led in self.blade_leds + self.moss_leds:
+                        led.set_brightness(0)
+                    for rgb in self.rgb_leds:
+                        rgb.set_color(0, 0, 0)
+                    return
+                self.controller.set_all_off()
+                self.controller.set_pwm(self.center_pin, *center)
 
         def center_led_breathe(self, duration=5, steps=200):
             self.center_led.breathe(duration, steps)
@@ -309,36 +555,31 @@ class PCA9685Controller:
 
         def blade_spin(self, duration=15):
             """Create a chasing effect on the windmill blades."""
-            start = time.time()
-            steps = len(self.blade_leds)
             delay = 0.25  # Adjust this value for desired speed
-            
-            while (time.time() - start) <= duration:
-                for i in range(steps):
-                    self.blade_leds[i].set_brightness(100)
-                    time.sleep(delay)
-                    self.blade_leds[i].set_brightness(0)
+            def render(t):
+                lit = int(t / delay) % len(self.blade_leds)
+                for i, led in enumerate(self.blade_leds):
+                    led.set_brightness(100 if i == lit else 0)
+            return self.controller.run_frames(render, duration)
 
         def blade_chase(self, duration=15, tail_length=2):
             """Create a chasing effect on the windmill blades with a tail."""
             steps = len(self.blade_leds)
-            step_duration = duration / (steps * 2)  # Adjust for a complete rotation
+            step_duration = duration / (steps * 2)  # two trips around the blades per show
 
-            start = time.time()
-            while (time.time()-start) <= duration:
-                for _ in range(int(duration / step_duration)):
-                    for i in range(steps):
-                        # Turn off all LEDs
-                        for led in self.blade_leds:
-                            led.set_brightness(0)
-                        
-                        # Light up the tail
-                        for j in range(tail_length):
-                            index = (i - j) % steps
-                            brightness = 100 - (j * (100 // tail_length))
-                            self.blade_leds[index].set_brightness(brightness)
-                        
-                        time.sleep(step_duration)
+            def render(t):
+                i = int(t / step_duration) % steps
+                # Turn off all LEDs, the shadow registers keep unchanged channels off the bus
+                for led in self.blade_leds:
+                    led.set_brightness(0)
+
+                # Light up the tail
+                for j in range(tail_length):
+                    index = (i - j) % steps
+                    brightness = 100 - (j * (100 // tail_length))
+                    self.blade_leds[index].set_brightness(brightness)
+
+            return self.controller.run_frames(render, duration)
 
 
         def rgb_breathe_color_wheel(self, duration=10):
@@ -369,94 +610,80 @@ class PCA9685Controller:
                 return (v, p, q)
 
         def rgb_color_wheel_tandem(self, duration=10, steps=200):
-            for i in range(steps):
-                hue = i / steps
-                r, g, b = [int(x * 255) for x in self.show_hsv_to_rgb(hue, 1, 1)]
+            table = self.controller.waveforms.get('hue', steps)
+            def render(t):
+                duties = table[int(t / duration * steps) % steps]
                 for rgb in self.rgb_leds:
-                    rgb.set_color(r * 100 / 255, g * 100 / 255, b * 100 / 255)
-                time.sleep(duration / steps)
+                    rgb.set_color_duty(duties)
+            return self.controller.run_frames(render, duration)
 
         def rgb_breathe_single_color(self, hex_color, duration=5, steps=100):
             r, g, b = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
-            print('set color')
-            for i in range(steps):
+            def render(t):
+                i = int(t / duration * steps)
                 brightness = (math.sin(i * math.pi / steps) + 1) / 2
-                print(f'brightness set to {brightness}')
                 for rgb_led in self.rgb_leds:
                     rgb_led.set_color(
                         r * brightness,
                         g * brightness,
                         b * brightness
                     )
-                    dur1 = time.sleep(0.1)
-                    print(f'slept for {dur1} inside rgb loop')
-                dur2 = 0.5
-                time.sleep(dur2)
-                print(f'slept for {dur2} outside rgb loop')
+            return self.controller.run_frames(render, duration)
 
 
         def rgb_single_color(self, hex_color, brightness = 50):
             r, g, b = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
             b2 = brightness/100
-            for rgb_led in self.rgb_leds:
-                rgb_led.set_color(
-                    r * b2,
-                    g * b2,
-                    b * b2)
-                
+            with self.controller.frame():
+                for rgb_led in self.rgb_leds:
+                    rgb_led.set_color(
+                        r * b2,
+                        g * b2,
+                        b * b2)
+
         def rgb_off(self, hex_color, brightness = 50):
             r, g, b = [int(hex_color[i:i+2], 16) for i in (1, 3, 5)]
             b2 = brightness/100
             start = time.time()
-            for rgb_led in self.rgb_leds:
-                rgb_led.set_color(
-                    r * b2,
-                    g * b2,
-                    b * b2)
+            with self.controller.frame():
+                for rgb_led in self.rgb_leds:
+                    rgb_led.set_color(
+                        r * b2,
+                        g * b2,
+                        b * b2)
 
         
         def moss_twinkle(self, duration=10):
             """Twinkle effect on moss garden LEDs with random brightness, sleep time, and LED selection."""
-            end_time = time.time() + duration
-            while time.time() < end_time:
-                # Select a random LED to twinkle
+            next_twinkle = [0.0]
+            def render(t):
+                if t < next_twinkle[0]:
+                    return
+                # Select a random LED and give it a random brightness
                 led = random.choice(self.moss_leds)
-                
-                # Set a random brightness for the selected LED
-                brightness = random.randint(0, 100)
-                led.set_brightness(brightness)
-                
-                # Set a random sleep time between 0.05 and 0.5 seconds
-                sleep_time = random.uniform(0.05, 0.5)
-                time.sleep(sleep_time)
+                led.set_brightness(random.randint(0, 100))
+                # Hold it for a random time between 0.05 and 0.5 seconds
+                next_twinkle[0] = t + random.uniform(0.05, 0.5)
+            return self.controller.run_frames(render, duration)
 
 
         def moss_breathe(self, duration, steps = 200):
-            start = time.time()
-            while(time.time() - start) <= duration:
-                for i in range(steps):
-                    for led in self.moss_leds:
-                        brightness = (math.sin(i * math.pi / steps) + 1) / 2 * 100
-                        led.set_brightness(brightness)
-                        time.sleep(0.1)  # Adjusted sleep time
-                for i in range(steps, 0, -1):
-                    for led in self.moss_leds:
-                        brightness = (math.sin(i * math.pi / steps) + 1) / 2 * 100
-                        led.set_brightness(brightness)
-                        time.sleep(0.1)  # Adjusted sleep time
-                
-                if (time.time() - start) >= duration:
-                    continue
+            # one up/down breathe of 2*steps steps over the whole duration, all moss LEDs in step
+            table = self.controller.waveforms.get('breathe', steps)
+            def render(t):
+                duty = table[int(t / duration * len(table)) % len(table)]
+                for led in self.moss_leds:
+                    led.set_duty(duty)
+            return self.controller.run_frames(render, duration)
 
 
         def alternating_blink(self, duration=15):
-            start = time.time()
-            while (time.time() - start) <= duration:
-                for i in range(2):
-                    for j in range(0, len(self.blade_leds), 2):
-                        self.blade_leds[j+i].set_brightness(100)
-                        self.blade_leds[j+1-i].set_brightness(0)
-                    time.sleep(0.33)
+            # even and odd blade LEDs swap every 0.33 s
+            def render(t):
+                phase = int(t / 0.33) % 2
+                for i, led in enumerate(self.blade_leds):
+                    led.set_brightness(100 if i % 2 == phase else 0)
+            return self.controller.run_frames(render, duration)
 
         def test_individual_channels(self, duration=5):
             """
@@ -487,20 +714,26 @@ class PCA9685Controller:
             print(f"test {channel} complete")
 
         def run_light_show(self, show_name, duration=15, color=None):
-            """Run a specific light show by name for 15 seconds"""
+            """Run a specific light show by name for 15 seconds
+            returns the frame engine stats for animated shows, None otherwise
+            setting controller.cancel_event stops the show at the next frame"""
 
+            stats = None
+            show_name = show_name.lower()  # GUI dropdown labels are mixed case
             if show_name == "all on":
                 self.all_on()
             elif show_name == "all off":
                 self.all_off()
             elif show_name == "blade chase":
-                self.blade_chase(duration)
+                stats = self.blade_chase(duration)
             elif show_name == "rgb fade":
-                self.rgb_color_wheel_tandem(duration)
+                stats = self.rgb_color_wheel_tandem(duration)
             elif show_name == "moss twinkle":
-                self.moss_twinkle(duration)
+                stats = self.moss_twinkle(duration)
+            elif show_name == "moss breathe":
+                stats = self.moss_breathe(duration)
             elif show_name == "alternating blink":
-                self.alternating_blink(duration)
+                stats = self.alternating_blink(duration)
             elif show_name == "rgb single color":
                 if color:
                     self.rgb_single_color(color, duration)
@@ -508,7 +741,9 @@ class PCA9685Controller:
                     self.rgb_single_color('#f23fe3', duration) # default is pink
             else:
                 pass
-            self.all_on()
+            if not self.controller.cancel_event.is_set():
+                self.all_on()  # a cancelled show leaves the LEDs to whatever preempted it
+            return stats
 
 
 
@@ -0,0 +1,244 @@
+import multiprocessing
+import queue
+import heapq
+import errno
+import json
+import os
+import signal
+import threading
+import time
+import ctypes
+from contextlib import contextmanager
+from smbus2 import i2c_msg
+from smbusmod import InstrumentedSMBus
+
+
+'''
+Single owner of the I2C bus
+- one BusOwner process opens the bus and runs every transaction
+- workers get a BusClient, which has the same methods as smbus2.SMBus, and pass it to
+  the drivers as bus=
+- requests are batches of bus operations, run strictly by priority (lower number first),
+  FIFO within a priority, so a temperature read never waits behind queued LED frames
+- reads wait for their reply, writes inside client.batch() are sent as one batch
+  without waiting; if such a batch fails the rest of it is dropped and the error is sent
+  back, the client picks it up with batch_errors()
+- the owner measures queueing delay (time from send to start of execution) per client
+- i2c_rdwr works too, i2c_msg objects are not picklable so the client sends
+  (addr, flags, data) and copies the read data back into its messages
+'''
+
+I2C_M_RD = 0x0001  # i2c_msg read flag
+
+
+class BusOwner:
+    PRIORITY_TEMPERATURE = 0
+    PRIORITY_LED = 10
+
+    def __init__(self, i2c_bus=1):
+        self.i2c_bus = i2c_bus
+        self.requests = multiprocessing.Queue()
+        self.replies = {}  # client name -> reply queue, queues can only be shared by inheritance
+        self.process = None
+
+    def create_client(self, name, priority):
+        # create clients before start() so the owner and worker processes inherit the queues
+        client = BusClient(name, priority, self.requests)
+        self.replies[name] = client.replies
+        return client
+
+    def start(self):
+        self.process = multiprocessing.Process(target=self.run, daemon=True)
+        self.process.start()
+
+    def stop(self):
+        self.requests.put(None)
+        if self.process is not None:
+            self.process.join(timeout=2)
+
+    def run(self, bus=None):
+        '''Owner loop, normally runs in the process made by start()'''
+        bus = bus if bus is not None else InstrumentedSMBus(self.i2c_bus, name='bus-owner')
+        clients = {}  # client name -> queueing/execution stats
+        pending = []
+        seq = 0
+
+        def snapshot():
+            return {'clients': {name: dict(stats) for name, stats in clients.items()}, 'bus': bus.snapshot()}
+
+        def dump(signum, frame):
+            path = os.path.join('/tmp', f'i2c_metrics_bus-owner_{os.getpid()}.json')
+            with open(path, 'w') as f:
+                json.dump(snapshot(), f, indent=2)
+            print(f'I2C bus owner metrics written to {path}')
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR1, dump)
+
+        while True:
+            # block only when there is nothing to run, then take everything already waiting
+            # so the priority order covers all of it
+            try:
+                request = self.requests.get() if not pending else self.requests.get_nowait()
+                while True:
+                    if request is None:
+                        return
+                    heapq.heappush(pending, (request['priority'], seq, request))
+                    seq += 1
+                    request = self.requests.get_nowait()
+            except queue.Empty:
+                pass
+
+            _, _, request = heapq.heappop(pending)
+            started = time.monotonic()
+            delay = started - request['sent_at']
+            stats = clients.setdefault(request['client'], {
+                'batches': 0, 'operations': 0, 'errors': 0,
+                'queue_delay_total_s': 0.0, 'queue_delay_max_s': 0.0, 'busy_s': 0.0,
+            })
+            stats['batches'] += 1
+            stats['operations'] += len(request['ops'])
+            stats['queue_delay_total_s'] += delay
+            stats['queue_delay_max_s'] = max(stats['queue_delay_max_s'], delay)
+            stats['queue_delay_mean_s'] = stats['queue_delay_total_s'] / stats['batches']
+
+            results = []
+            error = None
+            for method, args in request['ops']:
+                try:
+                    if method == 'stats':
+                        results.append(snapshot())
+                    elif method == 'i2c_rdwr':
+                        msgs = [i2c_msg.read(addr, len(data)) if flags & I2C_M_RD else i2c_msg.write(addr, data)
+                                for addr, flags, data in args]
+                        bus.i2c_rdwr(*msgs)
+                        results.append([list(msg) for msg in msgs])
+                    else:
+                        results.append(getattr(bus, method)(*args))
+                except OSError as e:
+                    error = (e.errno, e.strerror or str(e))
+                    stats['errors'] += 1
+                    if not request['reply']:
+                        print(f"I2C error in {request['client']} batch: {e}")
+                    break
+            stats['busy_s'] += time.monotonic() - started
+
+            if request['reply'] or error is not None:
+                self.replies[request['client']].put((request['id'], results, error))
+
+
+class BusClient:
+    '''SMBus-like handle that sends its transactions to the BusOwner process'''
+
+    def __init__(self, name, priority, requests, timeout=2.0):
+        self.name = name
+        self.priority = priority
+        self.requests = requests
+        self.replies = multiprocessing.Queue()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self._batch = None
+        self._next_id = 0
+        self._batch_errors = []  # errors of fire-and-forget batches not yet picked up
+
+    def _send(self, ops, reply):
+        self.requests.put({
+            'client': self.name,
+            'priority': self.priority,
+            'sent_at': time.monotonic(),
+            'id': self._next_id,
+            'ops': ops,
+            'reply': reply,
+        })
+
+    def _call(self, method, *args):
+        with self.lock:
+            if self._batch is not None and method.startswith('write'):
+                self._batch.append((method, args))
+                return None
+            if self._batch:
+                # a read inside a batch has to see the earlier writes, send them along first
+                ops, self._batch = self._batch + [(method, args)], []
+            else:
+                ops = [(method, args)]
+            self._next_id += 1
+            self._send(ops, reply=True)
+            try:
+                while True:
+                    request_id, results, error = self.replies.get(timeout=self.timeout)
+                    if request_id == self._next_id:
+                        break
+                    if error is not None:
+                        self._batch_errors.append(OSError(*error))  # an earlier batch failed
+            except queue.Empty:
+                raise OSError(errno.ETIMEDOUT, f'I2C bus owner did not answer {method}')
+            if error is not None:
+                raise OSError(*error)
+            return results[-1]
+
+    @contextmanager
+    def batch(self):
+        '''Collect the writes inside the with-block and send them as one batch without waiting'''
+        with self.lock:
+            nested = self._batch is not None
+            if not nested:
+                self._batch = []
+        try:
+            yield self
+        finally:
+            if not nested:
+                with self.lock:
+                    ops, self._batch = self._batch, None
+                    if ops:
+                        self._next_id += 1
+                        self._send(ops, reply=False)
+
+    def batch_errors(self):
+        '''Errors of earlier batch() writes since the last call, their remaining writes never ran'''
+        with self.lock:
+            try:
+                while True:
+                    request_id, results, error = self.replies.get_nowait()
+                    if error is not None:
+                        self._batch_errors.append(OSError(*error))
+            except queue.Empty:
+                pass
+            errors, self._batch_errors = self._batch_errors, []
+        return errors
+
+    def stats(self):
+        '''Queueing delay per client and the owner's bus metrics'''
+        return self._call('stats')
+
+    # smbus2.SMBus interface
+    def write_byte(self, i2c_addr, value, force=None):
+        return self._call('write_byte', i2c_addr, value)
+
+    def read_byte(self, i2c_addr, force=None):
+        return self._call('read_byte', i2c_addr)
+
+    def write_byte_data(self, i2c_addr, register, value, force=None):
+        return self._call('write_byte_data', i2c_addr, register, value)
+
+    def read_byte_data(self, i2c_addr, register, force=None):
+        return self._call('read_byte_data', i2c_addr, register)
+
+    def write_word_data(self, i2c_addr, register, value, force=None):
+        return self._call('write_word_data', i2c_addr, register, value)
+
+    def read_word_data(self, i2c_addr, register, force=None):
+        return self._call('read_word_data', i2c_addr, register)
+
+    def write_i2c_block_data(self, i2c_addr, register, data, force=None):
+        return self._call('write_i2c_block_data', i2c_addr, register, list(data))
+
+    def read_i2c_block_data(self, i2c_addr, register, length, force=None):
+        return self._call('read_i2c_block_data', i2c_addr, register, length)
+
+    def i2c_rdwr(self, *i2c_msgs):
+        results = self._call('i2c_rdwr', *[(msg.addr, msg.flags, list(msg)) for msg in i2c_msgs])
+        for msg, data in zip(i2c_msgs, results):
+            if msg.flags & I2C_M_RD:
+                ctypes.memmove(msg.buf, bytes(data), len(data))  # i2c_msg.buf is a ctypes buffer
+
+    def close(self):
+        pass
@@ -0,0 +1,70 @@
+'''
+GPIO backends for the motor driver (NEMA17mod2)
+- a backend claims a set of output pins once, then writes precompiled pin states
+- compile(pins, levels) turns a list of pins and levels into whatever the backend writes
+  fastest, so the step loop only does write(compiled), one call per step
+- RPiGPIOBackend: RPi.GPIO, the default, writes the pins one after another, so compile()
+  puts the pins going low first: between two coil phases the coils only pass through
+  states where fewer of them are on, never A1 and A2 (or B1 and B2) together
+- GpiodBackend: libgpiod v2 character device, all lines in one bulk request and every
+  write is a single set_values ioctl, so all coils change at once
+- GpiodBackend runs on any Linux box with the gpio-sim kernel module
+  (see GUI Testing/gpiosim_stepper.py)
+
+usage:
+    motor = Nema17(17, 18, 27, 22, 23, gpio=GpiodBackend('/dev/gpiochip0'))
+'''
+
+
+class RPiGPIOBackend:
+    def __init__(self):
+        import RPi.GPIO as GPIO  # only needed when this backend is used
+        self.GPIO = GPIO
+        GPIO.setmode(GPIO.BCM)
+
+    def setup(self, pins):
+        self.GPIO.setup(list(pins), self.GPIO.OUT)
+
+    def compile(self, pins, levels):
+        # low pins first, GPIO.output() sets them in list order
+        ordered = sorted(zip(pins, levels), key=lambda pin_level: 1 if pin_level[1] else 0)
+        return ([pin for pin, _ in ordered], tuple(level for _, level in ordered))
+
+    def write(self, compiled):
+        self.GPIO.output(*compiled)
+
+    def close(self):
+        pass  # GPIO.cleanup() is left to the program, it resets every pin
+
+
+class GpiodBackend:
+    def __init__(self, chip='/dev/gpiochip0', consumer='sunflow-nema17'):
+        '''
+        chip (str) : character device, /dev/gpiochip0 on a Pi 4 (line offsets are BCM numbers),
+                     check gpiodetect on a Pi 5 or for a gpio-sim chip
+        '''
+        import gpiod  # libgpiod v2 python bindings, pip install gpiod
+        from gpiod.line import Direction, Value
+        self.gpiod = gpiod
+        self.Direction = Direction
+        self.Value = Value
+        self.chip = chip
+        self.consumer = consumer
+        self.request = None
+
+    def setup(self, pins):
+        # one request for every line, it holds them until close()
+        settings = self.gpiod.LineSettings(direction=self.Direction.OUTPUT, output_value=self.Value.INACTIVE)
+        self.request = self.gpiod.request_lines(self.chip, consumer=self.consumer,
+                                                config={tuple(pins): settings})
+
+    def compile(self, pins, levels):
+        return {pin: (self.Value.ACTIVE if level else self.Value.INACTIVE) for pin, level in zip(pins, levels)}
+
+    def write(self, compiled):
+        self.request.set_values(compiled)
+
+    def close(self):
+        if self.request is not None:
+            self.request.release()
+            self.request = None
@@ -0,0 +1,198 @@
+import ctypes
+import gc
+import os
+import time
+import multiprocessing
+from NEMA17mod2 import MotorTelemetry, StepTimingStats, read_telemetry, wait_until
+
+
+'''
+Persistent motor worker
+- one process drives the Nema17 for the whole session, the GUI never respawns it
+- settings live in a shared-memory control block (MotorControlBlock) that the worker
+  reads at every step boundary, so a change applies within one step period
+- speed changes ramp from the current speed, a direction or step mode change
+  changes the stepping at the next step without dropping coil power
+- clearing the run flag puts the driver to sleep, the process stays up
+- step count, rotor position and measured RPM are published in a shared MotorTelemetry
+  block, any process started after the worker is created can read it with read_telemetry()
+- opt-in real-time mode (realtime=True): pins the worker to one core, asks for SCHED_FIFO
+  (or failing that a lower nice value), locks its memory and keeps the garbage collector out
+  of the step loop. Whatever is not permitted is skipped, and the wake-up jitter before and
+  after is printed
+- temp_slot: the temperature monitor's tempslotmod.TemperatureSlot, readable from the worker
+  as self.temp_slot.read(); the timing report at exit lists the temperatures it ended with
+'''
+
+DIRECTIONS = ('CW', 'CCW')
+STEP_MODES = ('Full', 'Half')
+
+
+class MotorControlBlock(ctypes.Structure):
+    # written by the GUI, read by the worker. Every field is one aligned word so reads are
+    # never torn and no lock is needed
+    _fields_ = [
+        ('rpm', ctypes.c_double),
+        ('direction', ctypes.c_int),  # index into DIRECTIONS
+        ('step_mode', ctypes.c_int),  # index into STEP_MODES
+        ('run', ctypes.c_bool),
+        ('exit', ctypes.c_bool),
+    ]
+
+
+def measure_jitter(duration=0.5, period_ns=2000000, spin_ns=200000):
+    '''
+    Lateness of duration seconds of timed wake-ups every period_ns, the way the step loop waits
+    Returns a StepTimingStats summary (mean/std/max in us).
+    '''
+    stats = StepTimingStats()
+    deadline = time.perf_counter_ns() + period_ns
+    end = deadline + int(duration * 1e9)
+    while deadline < end:
+        late = wait_until(deadline, spin_ns)
+        stats.add(late, deadline + late)
+        deadline += period_ns
+    return stats.summary()
+
+
+def enable_realtime(cpu=None, fifo_priority=50, nice=-10):
+    '''
+    Real-time settings for the calling process, each one skipped if not permitted
+    cpu (int) : core to pin to, default the last one we are allowed on (keep it free of other work,
+                e.g. isolcpus=3 on the kernel command line)
+    fifo_priority (int) : SCHED_FIFO priority, 1-99
+    nice (int) : used instead when SCHED_FIFO is refused
+    Returns a dict of what was applied.
+    '''
+    applied = {}
+    try:
+        if cpu is None:
+            cpu = max(os.sched_getaffinity(0))
+        os.sched_setaffinity(0, {cpu})
+        applied['cpu'] = cpu
+    except (OSError, AttributeError) as e:
+        applied['cpu'] = f'not pinned ({getattr(e, "strerror", None) or e})'
+
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(fifo_priority))
+        applied['scheduler'] = f'SCHED_FIFO {fifo_priority}'
+    except (OSError, AttributeError):
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+            applied['scheduler'] = f'nice {nice}'
+        except OSError as e:
+            applied['scheduler'] = f'default ({e.strerror})'
+
+    # keep pages from being swapped out or faulted in mid-step
+    MCL_CURRENT, MCL_FUTURE = 1, 2
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlockall(MCL_CURRENT | MCL_FUTURE) == 0:
+            applied['mlockall'] = True
+        else:
+            applied['mlockall'] = f'refused ({os.strerror(ctypes.get_errno())})'
+    except (OSError, AttributeError) as e:
+        applied['mlockall'] = f'unavailable ({e})'
+
+    # everything allocated so far is long lived, move it out of the collector's way
+    gc.collect()
+    gc.freeze()
+    return applied
+
+
+class MotorWorker:
+    def __init__(self, motor, rpm=10.0, direction='CW', step_mode='Full', realtime=False, temp_slot=None):
+        self.motor = motor
+        self.realtime = realtime
+        self.temp_slot = temp_slot  # has to exist before start(), the worker process inherits it
+        self.control = multiprocessing.Value(MotorControlBlock, lock=False)
+        self.changed = multiprocessing.Event()  # wakes an idle worker
+        self.telemetry = multiprocessing.Value(MotorTelemetry, lock=False)
+        motor.telemetry = self.telemetry
+        self.process = None
+        self.configure(rpm, direction, step_mode)
+
+    def configure(self, rpm=None, direction=None, step_mode=None):
+        '''Change any of the settings, a running motor picks them up at its next step'''
+        if rpm is not None:
+            self.control.rpm = rpm
+        if direction is not None:
+            self.control.direction = DIRECTIONS.index(direction)
+        if step_mode is not None:
+            self.control.step_mode = STEP_MODES.index(step_mode)
+        self.changed.set()
+
+    def set_running(self, run):
+        self.control.run = run
+        self.changed.set()
+
+    def read_telemetry(self):
+        return read_telemetry(self.telemetry)
+
+    def start(self):
+        self.process = multiprocessing.Process(target=self.run, daemon=True)
+        self.process.start()
+
+    def stop(self, timeout=2):
+        self.control.run = False
+        self.control.exit = True
+        self.changed.set()
+        if self.process is not None:
+            self.process.join(timeout=timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+
+    def run(self):
+        '''Worker loop, normally runs in the process made by start()'''
+        motor = self.motor
+        control = self.control
+        awake = False
+        start_rpm = None
+        if self.realtime:
+            before = measure_jitter(spin_ns=motor.SPIN_NS)
+            applied = enable_realtime()
+            after = measure_jitter(spin_ns=motor.SPIN_NS)
+            print(f"Motor worker real-time mode: {applied}")
+            print(f"wake-up jitter before: {before['mean_late_us']:.1f} us mean / {before['std_late_us']:.1f} us std / "
+                  f"{before['max_late_us']:.1f} us max, after: {after['mean_late_us']:.1f} us mean / "
+                  f"{after['std_late_us']:.1f} us std / {after['max_late_us']:.1f} us max")
+        while not control.exit:
+            if not control.run:
+                if awake:
+                    motor.sleep()
+                    awake = False
+                if self.realtime:
+                    gc.collect()  # idle, a good time for the collection the step loop skipped
+                self.changed.wait(timeout=0.5)
+                self.changed.clear()
+                continue
+            if not awake:
+                motor.wake()
+                awake = True
+                start_rpm = None  # ramp up from standstill
+
+            direction = control.direction
+            step_mode = control.step_mode
+
+            def check():
+                if not control.run or control.exit or control.step_mode != step_mode:
+                    return True
+                if control.direction != direction:
+                    return motor.ramp_down()  # slow to START_RPM first, then reverse from there
+                motor.set_speed(control.rpm)
+                return False
+
+            mode = STEP_MODES[step_mode]
+            if self.realtime:
+                gc.disable()  # steps only make short lived, acyclic objects, refcounting frees them
+            try:
+                motor.rotate(control.rpm, DIRECTIONS[direction], mode, start_rpm, check=check)
+            finally:
+                if self.realtime:
+                    gc.enable()
+            # a mode change keeps the speed, a reversal continues from START_RPM where ramp_down() left it
+            start_rpm = motor.current_rpm
+        motor.sleep()
+        print(motor.timing_report())
+        if self.temp_slot is not None:
+            print(f"Temperatures at motor stop: {self.temp_slot.summary()}")
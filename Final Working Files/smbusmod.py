@@ -0,0 +1,159 @@
+import smbus2
+import time
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+
+'''
+Instrumented SMBus wrapper shared by the I2C drivers (PCA9685mod3, MCP9808mod5)
+- same method names as smbus2.SMBus, so the drivers do not care which one they get
+- counts transactions and bytes per device address and register
+- keeps a latency histogram and error count per device
+- snapshot() returns the numbers as a dict, dump() writes them as JSON
+- in the GUI the workers talk to the bus through busownermod, the BusOwner process owns the only
+  InstrumentedSMBus and dumps it (with per-client queueing delay) on SIGUSR1
+'''
+
+
+class InstrumentedSMBus:
+    # upper edges of the latency histogram buckets in microseconds, the last bucket is open ended
+    LATENCY_BUCKETS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000)
+
+    def __init__(self, bus=1, name=None):
+        '''
+        bus (int or bus object) : bus number to open with smbus2, or an already open bus to wrap
+        name (str) : label used in dumps, e.g. 'pca9685'
+        '''
+        self.bus = smbus2.SMBus(bus) if isinstance(bus, int) else bus
+        self.name = name or f'i2c-{bus}'
+        self.lock = threading.RLock()  # re-entrant so a dump from a signal handler cannot deadlock
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        with self.lock:
+            self.devices = {}  # address -> counters, see _device()
+            self.started = time.monotonic()
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            device = {
+                'transactions': 0,
+                'bytes': 0,
+                'errors': 0,
+                'busy_s': 0.0,
+                'max_latency_us': 0.0,
+                'latency_hist': [0] * (len(self.LATENCY_BUCKETS_US) + 1),
+                'registers': {},  # register (None for raw transfers) -> [transactions, bytes, errors]
+            }
+            self.devices[address] = device
+        return device
+
+    def _record(self, address, register, nbytes, latency, error):
+        latency_us = latency * 1e6
+        bucket = 0
+        while bucket < len(self.LATENCY_BUCKETS_US) and latency_us > self.LATENCY_BUCKETS_US[bucket]:
+            bucket += 1
+        with self.lock:
+            device = self._device(address)
+            reg = device['registers'].setdefault(register, [0, 0, 0])
+            device['transactions'] += 1
+            reg[0] += 1
+            device['busy_s'] += latency
+            device['latency_hist'][bucket] += 1
+            device['max_latency_us'] = max(device['max_latency_us'], latency_us)
+            if error:
+                device['errors'] += 1
+                reg[2] += 1
+            else:
+                device['bytes'] += nbytes
+                reg[1] += nbytes
+
+    def _call(self, address, register, nbytes, func, *args):
+        # nbytes counts everything after the address byte, register pointer included
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except OSError:
+            self._record(address, register, nbytes, time.perf_counter() - start, True)
+            raise
+        self._record(address, register, nbytes, time.perf_counter() - start, False)
+        return result
+
+    # smbus2.SMBus interface
+    def write_byte(self, i2c_addr, value, force=None):
+        return self._call(i2c_addr, None, 1, self.bus.write_byte, i2c_addr, value)
+
+    def read_byte(self, i2c_addr, force=None):
+        return self._call(i2c_addr, None, 1, self.bus.read_byte, i2c_addr)
+
+    def write_byte_data(self, i2c_addr, register, value, force=None):
+        return self._call(i2c_addr, register, 2, self.bus.write_byte_data, i2c_addr, register, value)
+
+    def read_byte_data(self, i2c_addr, register, force=None):
+        return self._call(i2c_addr, register, 2, self.bus.read_byte_data, i2c_addr, register)
+
+    def write_word_data(self, i2c_addr, register, value, force=None):
+        return self._call(i2c_addr, register, 3, self.bus.write_word_data, i2c_addr, register, value)
+
+    def read_word_data(self, i2c_addr, register, force=None):
+        return self._call(i2c_addr, register, 3, self.bus.read_word_data, i2c_addr, register)
+
+    def write_i2c_block_data(self, i2c_addr, register, data, force=None):
+        return self._call(i2c_addr, register, 1 + len(data), self.bus.write_i2c_block_data, i2c_addr, register, data)
+
+    def read_i2c_block_data(self, i2c_addr, register, length, force=None):
+        return self._call(i2c_addr, register, 1 + length, self.bus.read_i2c_block_data, i2c_addr, register, length)
+
+    def i2c_rdwr(self, *i2c_msgs):
+        # combined transfer, counted once against the address of the first message
+        nbytes = sum(msg.len for msg in i2c_msgs)
+        return self._call(i2c_msgs[0].addr, None, nbytes, self.bus.i2c_rdwr, *i2c_msgs)
+
+    def close(self):
+        self.bus.close()
+
+    @contextmanager
+    def batch(self):
+        # transactions already go straight to the bus, this only matches busownermod.BusClient.batch()
+        yield self
+
+    def batch_errors(self):
+        # errors are raised straight away here, this only matches busownermod.BusClient.batch_errors()
+        return []
+
+    # reporting
+    def snapshot(self):
+        '''Return the metrics as a JSON friendly dict'''
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            devices = {}
+            for address, device in self.devices.items():
+                edges = [f'<={edge}us' for edge in self.LATENCY_BUCKETS_US]
+                edges.append(f'>{self.LATENCY_BUCKETS_US[-1]}us')
+                devices[f'0x{address:02X}'] = {
+                    'transactions': device['transactions'],
+                    'bytes': device['bytes'],
+                    'errors': device['errors'],
+                    'busy_s': device['busy_s'],
+                    'bus_utilisation': device['busy_s'] / uptime if uptime > 0 else 0.0,
+                    'mean_latency_us': device['busy_s'] * 1e6 / device['transactions'],
+                    'max_latency_us': device['max_latency_us'],
+                    'latency_hist': dict(zip(edges, device['latency_hist'])),
+                    'registers': {
+                        ('raw' if register is None else f'0x{register:02X}'):
+                            {'transactions': reg[0], 'bytes': reg[1], 'errors': reg[2]}
+                        for register, reg in device['registers'].items()
+                    },
+                }
+            return {'name': self.name, 'pid': os.getpid(), 'uptime_s': uptime, 'devices': devices}
+
+    def dump(self, path=None):
+        '''Write snapshot() as JSON, returns the path used'''
+        if path is None:
+            path = os.path.join('/tmp', f'i2c_metrics_{self.name}_{os.getpid()}.json')
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
@@ -0,0 +1,110 @@
+import ctypes
+import multiprocessing
+import time
+
+
+'''
+Latest-value temperature slot in shared memory
+- the temperature monitor publish()es into it, readers in any process started after it was
+  created (GUI, motor worker, LED worker) read() the newest value without a queue to drain
+- a seqlock counter makes reads lock-free: the writer makes seq odd while it writes,
+  readers retry until they copied the record with the same even seq before and after
+- one record holds a reading for every sensor of the array (up to MAX_SENSORS), each with
+  its address, trip temperature and a validity flag the monitor clears when that sensor
+  stops answering
+- every record carries a timestamp (time.monotonic(), shared between processes)
+- one waiter (the GUI) can block in wait() until something new is published
+'''
+
+MAX_SENSORS = 8  # MCP9808 addresses 0x18 to 0x1F
+READ_RETRIES = 100  # read() gives up after this many tries, the monitor may have died mid-write
+
+
+class TemperatureRecord(ctypes.Structure):
+    _fields_ = [
+        ('seq', ctypes.c_uint64),  # odd while a write is in progress, +2 per publish
+        ('timestamp', ctypes.c_double),  # time.monotonic() of the reading
+        ('count', ctypes.c_uint8),  # sensors in use
+        ('addresses', ctypes.c_uint8 * MAX_SENSORS),
+        ('temperatures', ctypes.c_double * MAX_SENSORS),
+        ('trips', ctypes.c_double * MAX_SENSORS),
+        ('valid', ctypes.c_bool * MAX_SENSORS),
+        ('reason', ctypes.c_char * 64),  # why it was published, e.g. 'motor upper set'
+    ]
+
+
+class TemperatureSlot:
+    def __init__(self):
+        self.record = multiprocessing.Value(TemperatureRecord, lock=False)
+        self.updated = multiprocessing.Event()
+
+    def publish(self, readings, reason=''):
+        '''readings: (address, temperature, trip, valid) for every sensor, at most MAX_SENSORS'''
+        record = self.record
+        record.seq += 1
+        record.timestamp = time.monotonic()
+        record.count = len(readings)
+        for i, (address, temperature, trip, valid) in enumerate(readings):
+            record.addresses[i] = address
+            record.temperatures[i] = temperature
+            record.trips[i] = trip
+            record.valid[i] = valid
+        record.reason = reason.encode()[:63]
+        record.seq += 1
+        self.updated.set()
+
+    def invalidate(self, reason='sensor error'):
+        # keep the last temperatures but mark them all as no longer current
+        record = self.record
+        self.publish([(record.addresses[i], record.temperatures[i], record.trips[i], False)
+                      for i in range(record.count)], reason)
+
+    def read(self):
+        '''
+        Newest record as a dict (seq 0 means nothing was published yet)
+        if the monitor was killed halfway through a publish the last copy comes back with
+        'consistent' False instead of read() spinning forever
+        '''
+        record = self.record
+        for _ in range(READ_RETRIES):
+            seq = record.seq
+            count = min(record.count, MAX_SENSORS)
+            snapshot = {
+                'seq': seq // 2,
+                'timestamp': record.timestamp,
+                'sensors': [{
+                    'address': address,
+                    'temperature': temperature,
+                    'trip': trip,
+                    'valid': valid,
+                } for address, temperature, trip, valid in zip(record.addresses[:count], record.temperatures[:count],
+                                                               record.trips[:count], record.valid[:count])],
+                'reason': record.reason.decode(errors='replace'),  # publish() may cut a character in half
+            }
+            if seq % 2 == 0 and record.seq == seq:
+                snapshot['consistent'] = True
+                break
+            time.sleep(0)  # let the writer finish
+        else:
+            snapshot['consistent'] = False
+        snapshot['valid'] = any(sensor['valid'] for sensor in snapshot['sensors'])
+        snapshot['age'] = time.monotonic() - snapshot['timestamp'] if snapshot['seq'] else None
+        return snapshot
+
+    def summary(self):
+        '''Current sensor temperatures as one line for log output'''
+        sensors = [sensor for sensor in self.read()['sensors'] if sensor['valid']]
+        return ", ".join(f"0x{sensor['address']:02X} {sensor['temperature']:.2f}C" for sensor in sensors) or "no reading"
+
+    def wait(self, last_seq=0, timeout=None):
+        '''
+        Block until a record newer than last_seq is published, then return it
+        returns None on timeout. Only one process should wait, wait() clears the shared event
+        '''
+        while True:
+            snapshot = self.read()
+            if snapshot['seq'] != last_seq:
+                return snapshot
+            if not self.updated.wait(timeout):
+                return None
+            self.updated.clear()
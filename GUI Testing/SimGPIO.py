@@ -0,0 +1,125 @@
+import sys
+import time
+import types
+import numpy as np
+
+
+'''
+Recording stand-in for RPi.GPIO, for running the real NEMA17mod2 stepping code off the Pi
+- has the RPi.GPIO calls the drivers use (setmode, setup, output, input, cleanup, setwarnings)
+- every pin change is timestamped with time.perf_counter_ns() into preallocated arrays,
+  so recording costs about as much as the real call and nothing is allocated per step
+- output() with a list of pins writes them one at a time in list order, like the real module,
+  so the short in-between coil states show up in the recording
+- coil_states() replays the recording into coil bitmasks for checking step timing and
+  illegal combinations (A1 and A2, or B1 and B2, high together)
+
+usage (before the drivers are imported):
+    import SimGPIO
+    gpio = SimGPIO.install()
+    from NEMA17mod2 import Nema17
+'''
+
+
+class SimGPIO(types.ModuleType):
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, capacity=1_000_000):
+        super().__init__('RPi.GPIO')
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.pins = np.zeros(capacity, dtype=np.int16)
+        self.levels = np.zeros(capacity, dtype=np.int8)
+        self.call_ids = np.zeros(capacity, dtype=np.int64)  # which output() call made the change
+        self.count = 0
+        self.dropped = 0  # transitions after the arrays filled up
+        self.mode = None
+        self.state = {}  # pin -> level
+        self.initial_state = {}  # levels when the recording was last reset
+        self.calls = 0  # output() calls, one per step for the bulk driver
+
+    def reset(self):
+        self.initial_state = dict(self.state)
+        self.count = 0
+        self.dropped = 0
+        self.calls = 0
+
+    # RPi.GPIO interface
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channels, direction, initial=None, pull_up_down=None):
+        for pin in (channels if isinstance(channels, (list, tuple)) else [channels]):
+            self.state.setdefault(pin, 0)
+
+    def output(self, channels, values):
+        self.calls += 1
+        if not isinstance(channels, (list, tuple)):
+            channels, values = [channels], [values]
+        elif not isinstance(values, (list, tuple)):
+            values = [values] * len(channels)
+        for pin, value in zip(channels, values):
+            value = 1 if value else 0
+            if self.state.get(pin) == value:
+                continue
+            self.state[pin] = value
+            if self.count < len(self.times):
+                i = self.count
+                self.times[i] = time.perf_counter_ns()
+                self.pins[i] = pin
+                self.levels[i] = value
+                self.call_ids[i] = self.calls
+                self.count += 1
+            else:
+                self.dropped += 1
+
+    def input(self, channel):
+        return self.state.get(channel, 0)
+
+    def cleanup(self, channels=None):
+        self.state.clear()
+
+    # analysis
+    def coil_states(self, coil_pins):
+        '''
+        Replay the recording into coil states
+        coil_pins : [A1, B1, A2, B2], the bitmask bits are read A1 B1 A2 B2 like NEMA17mod2
+        returns (times, masks, call_ids): the time each state started, its bitmask and the
+        output() call that made it, one entry per transition
+        '''
+        bits = {pin: 1 << (3 - i) for i, pin in enumerate(coil_pins)}
+        n = self.count
+        times = self.times[:n]
+        pins = self.pins[:n]
+        levels = self.levels[:n]
+        call_ids = self.call_ids[:n]
+        keep = np.isin(pins, list(bits))
+        times, pins, levels, call_ids = times[keep], pins[keep], levels[keep], call_ids[keep]
+
+        masks = np.zeros(len(times), dtype=np.int8)
+        mask = sum(bit for pin, bit in bits.items() if self.initial_state.get(pin))
+        for i in range(len(times)):
+            bit = bits[int(pins[i])]
+            mask = (mask | bit) if levels[i] else (mask & ~bit)
+            masks[i] = mask
+        return times, masks, call_ids
+
+
+def install(capacity=1_000_000):
+    '''
+    Put the fake RPi and RPi.GPIO modules in sys.modules
+    call before NEMA17mod2 is imported, returns the recording module
+    '''
+    gpio = SimGPIO(capacity)
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = gpio
+    return gpio
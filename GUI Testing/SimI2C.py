@@ -0,0 +1,423 @@
+import sys
+import time
+import types
+import ctypes
+import errno
+
+
+'''
+Simulated I2C bus for running the real drivers (PCA9685mod3, MCP9808mod5) off the Pi
+- SimI2CBus has the smbus2.SMBus methods the drivers use, plus i2c_rdwr with i2c_msg
+- devices are modelled at the byte level (pointer byte then data), so SMBus calls
+  turn into the same bytes they would put on the wire
+- SimPCA9685: full register file, MODE1 auto-increment, prescale (only taken while asleep), ALL_LED
+- SimMCP9808: pointer register, temperature with alert flags, config, limits, resolution,
+  conversion time, reset() for a power cycle (pointer back on register 0)
+- every transaction is timed as if it ran on a 100 kHz or 400 kHz bus, optionally for real
+
+usage (before the drivers are imported):
+    import SimI2C
+    bus = SimI2C.install(bus_hz=100000)
+    from PCA9685mod3 import PCA9685Controller   # now talks to bus.devices[0x40]
+'''
+
+
+I2C_M_RD = 0x0001
+
+
+class i2c_msg(ctypes.Structure):
+    '''
+    Stand-in for smbus2.i2c_msg with the same ctypes layout: buf points at a ctypes buffer,
+    a read is copied into it and iterating yields ints, so code that fills the buffer with
+    ctypes.memmove (BusClient) works on both
+    '''
+    _fields_ = [
+        ('addr', ctypes.c_uint16),
+        ('flags', ctypes.c_uint16),
+        ('len', ctypes.c_uint16),
+        ('buf', ctypes.POINTER(ctypes.c_char)),
+    ]
+
+    @classmethod
+    def read(cls, address, length):
+        return cls(addr=address, flags=I2C_M_RD, len=length, buf=ctypes.create_string_buffer(length))
+
+    @classmethod
+    def write(cls, address, buf):
+        if isinstance(buf, str):
+            buf = buf.encode()
+        buf = bytes(buf)
+        return cls(addr=address, flags=0, len=len(buf), buf=ctypes.create_string_buffer(buf, len(buf)))
+
+    def __iter__(self):
+        return iter(bytes(self))
+
+    def __len__(self):
+        return self.len
+
+    def __bytes__(self):
+        return ctypes.string_at(self.buf, self.len)
+
+
+class SimI2CBus:
+    # each byte is 8 data bits + ack, a transaction adds start and stop
+    BITS_PER_BYTE = 9
+
+    def __init__(self, bus_hz=100000, overhead_us=0.0, realtime=False):
+        '''
+        bus_hz (int) : SCL frequency to model, 100000 or 400000 on the Pi
+        overhead_us (float) : fixed cost added to every transaction (kernel/ioctl time)
+        realtime (bool) : busy-wait for the modelled time so callers see real latency
+        '''
+        self.bus_hz = bus_hz
+        self.overhead_us = overhead_us
+        self.realtime = realtime
+        self.devices = {}  # address -> device model
+        self.transactions = 0
+        self.bytes = 0  # wire bytes including address bytes
+        self.sim_time = 0.0  # seconds of modelled bus time
+
+    def attach(self, address, device):
+        self.devices[address] = device
+        return device
+
+    def transfer_time(self, wire_bytes, starts=1):
+        return (wire_bytes * self.BITS_PER_BYTE + 2 * starts) / self.bus_hz + self.overhead_us * 1e-6
+
+    def _device(self, address):
+        device = self.devices.get(address)
+        if device is None:
+            # a missing device NACKs its address, smbus2 surfaces that as EREMOTEIO
+            self._account(1)
+            raise OSError(errno.EREMOTEIO, 'Remote I/O error')
+        return device
+
+    def _account(self, wire_bytes, starts=1):
+        duration = self.transfer_time(wire_bytes, starts)
+        self.transactions += 1
+        self.bytes += wire_bytes
+        self.sim_time += duration
+        if self.realtime:
+            end = time.perf_counter() + duration
+            while time.perf_counter() < end:
+                pass
+
+    def _write(self, address, data):
+        self._device(address).write(list(data))
+        self._account(1 + len(data))
+
+    def _write_read(self, address, data, length):
+        # write then repeated start and read, as the SMBus read commands do
+        device = self._device(address)
+        device.write(list(data))
+        result = device.read(length)
+        self._account(2 + len(data) + length, starts=2)
+        return result
+
+    # smbus2.SMBus interface
+    def write_byte(self, i2c_addr, value, force=None):
+        self._write(i2c_addr, [value])
+
+    def read_byte(self, i2c_addr, force=None):
+        result = self._device(i2c_addr).read(1)
+        self._account(2)
+        return result[0]
+
+    def write_byte_data(self, i2c_addr, register, value, force=None):
+        self._write(i2c_addr, [register, value & 0xFF])
+
+    def read_byte_data(self, i2c_addr, register, force=None):
+        return self._write_read(i2c_addr, [register], 1)[0]
+
+    def write_word_data(self, i2c_addr, register, value, force=None):
+        # SMBus sends the low byte first
+        self._write(i2c_addr, [register, value & 0xFF, (value >> 8) & 0xFF])
+
+    def read_word_data(self, i2c_addr, register, force=None):
+        low, high = self._write_read(i2c_addr, [register], 2)
+        return low | (high << 8)
+
+    def write_i2c_block_data(self, i2c_addr, register, data, force=None):
+        if len(data) > 32:
+            raise ValueError('Data length cannot exceed 32 bytes')
+        self._write(i2c_addr, [register] + [b & 0xFF for b in data])
+
+    def read_i2c_block_data(self, i2c_addr, register, length, force=None):
+        if length > 32:
+            raise ValueError('Desired block length over 32 bytes')
+        return self._write_read(i2c_addr, [register], length)
+
+    def i2c_rdwr(self, *i2c_msgs):
+        # one combined transaction, every message after the first costs a repeated start
+        wire_bytes = 0
+        for msg in i2c_msgs:
+            device = self._device(msg.addr)
+            if msg.flags & I2C_M_RD:
+                data = bytes(device.read(msg.len))
+                ctypes.memmove(msg.buf, data, len(data))
+            else:
+                device.write(list(msg))
+            wire_bytes += 1 + msg.len
+        self._account(wire_bytes, starts=len(i2c_msgs))
+
+    def close(self):
+        pass
+
+
+class SimPCA9685:
+    MODE1 = 0x00
+    LED0_ON_L = 0x06
+    LAST_LED_REG = 0x45  # LED15_OFF_H, auto-increment rolls over to MODE1 after it
+    ALL_LED_ON_L = 0xFA
+    PRESCALE = 0xFE
+    MODE1_SLEEP = 0x10
+    MODE1_AI = 0x20
+    OSC_HZ = 25000000
+
+    def __init__(self):
+        self.regs = [0] * 256
+        self.regs[self.MODE1] = 0x11  # power-on: SLEEP and ALLCALL
+        self.regs[0x01] = 0x04  # MODE2 totem pole
+        for channel in range(16):
+            self.regs[self.LED0_ON_L + 4 * channel + 3] = 0x10  # LEDn full off
+        self.regs[self.PRESCALE] = 0x1E  # 200 Hz
+        self.pointer = 0
+        self.ignored_prescale_writes = 0
+
+    def _next(self, reg):
+        if not self.regs[self.MODE1] & self.MODE1_AI:
+            return reg
+        if reg == self.LAST_LED_REG:
+            return 0x00
+        return (reg + 1) & 0xFF
+
+    def _store(self, reg, value):
+        if reg == self.PRESCALE and not self.regs[self.MODE1] & self.MODE1_SLEEP:
+            self.ignored_prescale_writes += 1  # the chip only takes PRESCALE while asleep
+            return
+        self.regs[reg] = value
+        if self.ALL_LED_ON_L <= reg <= self.ALL_LED_ON_L + 3:
+            offset = reg - self.ALL_LED_ON_L
+            for channel in range(16):
+                self.regs[self.LED0_ON_L + 4 * channel + offset] = value
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0]
+        for value in data[1:]:
+            self._store(self.pointer, value)
+            self.pointer = self._next(self.pointer)
+
+    def read(self, length):
+        result = []
+        for _ in range(length):
+            result.append(self.regs[self.pointer])
+            self.pointer = self._next(self.pointer)
+        return result
+
+    # inspection helpers
+    def channel(self, channel):
+        base = self.LED0_ON_L + 4 * channel
+        on = self.regs[base] | (self.regs[base + 1] << 8)
+        off = self.regs[base + 2] | (self.regs[base + 3] << 8)
+        return (on, off)
+
+    def duty(self, channel):
+        '''Fraction of the PWM period the output is high, following the full on/off bits'''
+        on, off = self.channel(channel)
+        if off & 0x1000:
+            return 0.0
+        if on & 0x1000:
+            return 1.0
+        return ((off & 0xFFF) - (on & 0xFFF)) % 4096 / 4096
+
+    @property
+    def frequency(self):
+        return self.OSC_HZ / (4096 * (self.regs[self.PRESCALE] + 1))
+
+
+class SimMCP9808:
+    REG_RFU = 0x00
+    REG_CONFIG = 0x01
+    REG_TUPPER = 0x02
+    REG_TLOWER = 0x03
+    REG_TCRITICAL = 0x04
+    REG_TEMPERATURE = 0x05
+    REG_MANUFACTURER = 0x06
+    REG_DEVICE = 0x07
+    REG_RESOLUTION = 0x08
+
+    # resolution register value -> (degrees per LSB, conversion time in seconds)
+    RESOLUTIONS = {0: (0.5, 0.030), 1: (0.25, 0.065), 2: (0.125, 0.130), 3: (0.0625, 0.250)}
+
+    def __init__(self, temperature=25.0):
+        self.temperature = temperature  # what the die actually is, set this to drive the model
+        self.regs = {
+            self.REG_RFU: 0x001D,
+            self.REG_CONFIG: 0x0000,
+            self.REG_TUPPER: 0x0000,
+            self.REG_TLOWER: 0x0000,
+            self.REG_TCRITICAL: 0x0000,
+            self.REG_MANUFACTURER: 0x0054,
+            self.REG_DEVICE: 0x0400,
+            self.REG_RESOLUTION: 0x03,
+        }
+        self.pointer = self.REG_TEMPERATURE
+        self.interrupt_latched = False
+        self._sample = None
+        self._sample_time = None
+        self.stale_reads = 0  # temperature reads that came before the next conversion finished
+        self.resets = 0
+
+    def reset(self):
+        '''Power cycle or brown-out: registers back to their defaults, pointer on register 0'''
+        stale_reads, resets = self.stale_reads, self.resets
+        self.__init__(self.temperature)
+        self.pointer = self.REG_RFU
+        self.stale_reads, self.resets = stale_reads, resets + 1
+
+    @property
+    def resolution(self):
+        return self.RESOLUTIONS[self.regs[self.REG_RESOLUTION] & 0x03][0]
+
+    @property
+    def conversion_time(self):
+        return self.RESOLUTIONS[self.regs[self.REG_RESOLUTION] & 0x03][1]
+
+    @staticmethod
+    def encode(temp_c, step=0.0625):
+        # 13-bit two's complement in 1/16 degC, truncated to the resolution step
+        counts = int(temp_c / step) * int(step * 16)
+        return counts & 0x1FFF
+
+    @staticmethod
+    def decode(raw):
+        raw &= 0x1FFF
+        if raw & 0x1000:
+            raw -= 0x2000
+        return raw / 16.0
+
+    def _limit(self, reg):
+        return self.decode(self.regs[reg] & 0x1FFC)
+
+    def _converted(self):
+        # the temperature register only changes when a conversion completes
+        now = time.monotonic()
+        if self._sample is None or now - self._sample_time >= self.conversion_time:
+            self._sample = self.temperature
+            self._sample_time = now
+        else:
+            self.stale_reads += 1
+        return self._sample
+
+    def _temperature_register(self):
+        temp_c = self._converted()
+        value = self.encode(temp_c, self.resolution)
+        if temp_c >= self._limit(self.REG_TCRITICAL):
+            value |= 0x8000
+        if temp_c > self._limit(self.REG_TUPPER):
+            value |= 0x4000
+        if temp_c < self._limit(self.REG_TLOWER):
+            value |= 0x2000
+        if self.regs[self.REG_CONFIG] & 0x0001 and value & 0xE000:
+            self.interrupt_latched = True  # interrupt mode holds until the clear bit is written
+        return value
+
+    @property
+    def alert_asserted(self):
+        '''Logical state of the ALERT output (before polarity), per the config register'''
+        config = self.regs[self.REG_CONFIG]
+        if not config & 0x0008:
+            return False
+        temp_c = self._sample if self._sample is not None else self.temperature
+        critical = temp_c >= self._limit(self.REG_TCRITICAL)
+        if config & 0x0004:
+            return critical
+        if config & 0x0001:
+            return self.interrupt_latched or critical
+        return critical or temp_c > self._limit(self.REG_TUPPER) or temp_c < self._limit(self.REG_TLOWER)
+
+    def write(self, data):
+        if not data:
+            return
+        self.pointer = data[0] & 0x0F
+        payload = data[1:]
+        if not payload:
+            return  # pointer-only write, sets up the next read
+        if self.pointer == self.REG_RESOLUTION:
+            self.regs[self.REG_RESOLUTION] = payload[0] & 0x03
+        elif self.pointer in (self.REG_CONFIG, self.REG_TUPPER, self.REG_TLOWER, self.REG_TCRITICAL):
+            value = (payload[0] << 8) | (payload[1] if len(payload) > 1 else 0)  # MSB first
+            if self.pointer == self.REG_CONFIG:
+                if value & 0x0020:
+                    self.interrupt_latched = False
+                value &= ~0x0020  # interrupt clear always reads back as 0
+            else:
+                value &= 0x1FFC
+            self.regs[self.pointer] = value
+
+    def read(self, length):
+        if self.pointer == self.REG_TEMPERATURE:
+            value = self._temperature_register()
+        else:
+            value = self.regs.get(self.pointer, 0)
+        if self.pointer == self.REG_RESOLUTION:
+            data = [value & 0xFF]
+        else:
+            data = [(value >> 8) & 0xFF, value & 0xFF]  # MSB first on the wire
+        return (data * length)[:length]
+
+
+_buses = {}
+
+
+def install(bus_hz=100000, overhead_us=0.0, realtime=False, pca_address=0x40, mcp_addresses=(0x18,)):
+    '''
+    Put a fake smbus2 module in sys.modules whose SMBus(n) returns a shared SimI2CBus
+    call before PCA9685mod3 / MCP9808mod5 / smbusmod are imported
+    returns the simulated bus 1 with a PCA9685 and MCP9808(s) attached
+    '''
+    def SMBus(bus=None, force=False):
+        if bus not in _buses:
+            _buses[bus] = SimI2CBus(bus_hz, overhead_us, realtime)
+        return _buses[bus]
+
+    module = types.ModuleType('smbus2')
+    module.SMBus = SMBus
+    module.i2c_msg = i2c_msg
+    sys.modules['smbus2'] = module
+
+    _buses.clear()
+    bus = SMBus(1)
+    if pca_address is not None:
+        bus.attach(pca_address, SimPCA9685())
+    for address in mcp_addresses:
+        bus.attach(address, SimMCP9808())
+    return bus
+
+
+if __name__ == "__main__":
+    import os
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+    for bus_hz in (100000, 400000):
+        sim = install(bus_hz=bus_hz, overhead_us=50, realtime=True)
+        from PCA9685mod3 import PCA9685Controller
+        from MCP9808mod5 import MCP9808
+
+        controller = PCA9685Controller()
+        led_show = controller.create_light_show()
+        led_show.all_on()
+        pca = sim.devices[0x40]
+        print(f"{bus_hz // 1000} kHz: PWM {pca.frequency:.1f} Hz, blade LED duty {pca.duty(1):.2f}, "
+              f"RGB red duty {pca.duty(5):.2f}")
+
+        sim.devices[0x18].temperature = 27.3
+        sensor = MCP9808()
+        print(f"{bus_hz // 1000} kHz: temperature {sensor.threebit_read_temperature()} degC")
+        print(f"{bus_hz // 1000} kHz: {sim.transactions} transactions, {sim.bytes} bytes, "
+              f"{sim.sim_time * 1000:.2f} ms of bus time")
+
+        for name in ('PCA9685mod3', 'MCP9808mod5', 'smbusmod'):
+            sys.modules.pop(name, None)  # re-import against the next simulated bus
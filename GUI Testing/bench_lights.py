@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import json
+import argparse
+from contextlib import redirect_stdout
+import numpy as np
+
+import SimI2C
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+
+'''
+Light show benchmark
+- runs every show run_light_show dispatches plus the LED/RGBLED/BatchLED effects
+  against the simulated bus (SimI2C), through the normal InstrumentedSMBus wrapper
+- reports achieved fps, I2C transactions and bytes per frame, frame-time percentiles
+  and how far each show overran its requested duration, all over the frames the frame
+  engine rendered (not the all_on() after a show or the read that timestamps the first frame)
+- prints JSON, or writes it with --output, so runs before/after a driver change can be diffed
+
+example:
+    python3 bench_lights.py --duration 3 --bus-hz 100000 --output before.json
+'''
+
+SHOWS = ["blade chase", "rgb fade", "moss twinkle", "moss breathe", "alternating blink", "rgb single color"]
+
+
+def effects(led_show, duration):
+    '''name -> callable running one effect for roughly duration seconds'''
+    controller = led_show.controller
+    center = led_show.center_led
+    rgb = led_show.rgb_leds[0]
+    blades = controller.BatchLED(led_show.blade_leds)
+    return {
+        'LED.breathe': lambda: center.breathe(duration),
+        'LED.pulse': lambda: center.pulse(duration * 4 / 3),  # pulse runs for 3/4 of its duration
+        'RGBLED.color_cycle': lambda: rgb.color_cycle(duration),
+        'RGBLED.breathe_color_wheel': lambda: rgb.breathe_color_wheel(duration),
+        'BatchLED.breathe': lambda: blades.breathe(duration),
+        'BatchLED.chase': lambda: blades.chase(duration),
+    }
+
+
+def measure(controller, sim, name, kind, requested, run):
+    '''
+    Counts only what run_frames() renders: the all_on() run_light_show does afterwards and the
+    sync() read that timestamps the first frame are left out. Runs without frames (a static
+    show) are counted whole.
+    '''
+    address = f'0x{controller.address:02X}'
+
+    def counters():
+        device = controller.bus.snapshot()['devices'].get(address, {})
+        return {'transactions': device.get('transactions', 0), 'bytes': device.get('bytes', 0),
+                'wire_bytes': sim.bytes, 'bus_time_s': sim.sim_time}
+
+    def delta(after, before):
+        return {key: after[key] - before[key] for key in after}
+
+    window = {}
+    excluded = {'transactions': 0, 'bytes': 0, 'wire_bytes': 0, 'bus_time_s': 0.0}
+    run_frames, sync = controller.run_frames, controller.sync
+
+    def counted_run_frames(*args, **kwargs):
+        window['start'] = counters()
+        stats = run_frames(*args, **kwargs)
+        window['end'] = counters()
+        return stats
+
+    def uncounted_sync():
+        before = counters()
+        done = sync()
+        for key, value in delta(counters(), before).items():
+            excluded[key] += value
+        return done
+
+    controller.bus.reset_metrics()
+    controller.last_frame_stats = None
+    controller.run_frames, controller.sync = counted_run_frames, uncounted_sync
+    try:
+        before = counters()
+        start = time.monotonic()
+        run()
+        elapsed = time.monotonic() - start
+        after = counters()
+    finally:
+        del controller.run_frames, controller.sync  # back to the class methods
+
+    stats = controller.last_frame_stats or {}
+    frames = stats.get('frames', 0)
+    if frames:
+        counted = delta(window['end'], window['start'])
+        counted = {key: value - excluded[key] for key, value in counted.items()}
+        elapsed = stats['elapsed']
+    else:
+        counted = delta(after, before)
+    result = {
+        'name': name,
+        'kind': kind,
+        'requested_s': requested,
+        'elapsed_s': elapsed,
+        'overrun_s': elapsed - requested if frames else 0.0,
+        'frames': frames,
+        'dropped': stats.get('dropped', 0),
+        'fps': stats.get('fps', 0.0),
+        'target_fps': stats.get('target_fps', 0.0),
+        'transactions': counted['transactions'],
+        'bytes': counted['bytes'],
+        'wire_bytes': counted['wire_bytes'],
+        'bus_time_s': counted['bus_time_s'],
+        'skipped_channel_writes': controller.skipped_writes,
+    }
+    if frames:
+        result['transactions_per_frame'] = result['transactions'] / frames
+        result['bytes_per_frame'] = result['bytes'] / frames
+        frame_ms = np.array(stats['frame_times']) * 1000
+        result['frame_time_ms'] = {
+            'p50': float(np.percentile(frame_ms, 50)),
+            'p90': float(np.percentile(frame_ms, 90)),
+            'p99': float(np.percentile(frame_ms, 99)),
+            'max': float(frame_ms.max()),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PCA9685 light shows on a simulated I2C bus')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per show (default 5)')
+    parser.add_argument('--bus-hz', type=int, default=100000, help='modelled SCL rate (default 100000)')
+    parser.add_argument('--overhead-us', type=float, default=50.0, help='fixed cost per transaction (default 50)')
+    parser.add_argument('--no-realtime', action='store_true', help='do not spend the modelled bus time')
+    parser.add_argument('--fps', type=float, default=None, help='override the frame engine target fps')
+    parser.add_argument('--only', nargs='*', default=None, help='names of shows/effects to run')
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    sim = SimI2C.install(bus_hz=args.bus_hz, overhead_us=args.overhead_us, realtime=not args.no_realtime)
+    from PCA9685mod3 import PCA9685Controller
+
+    controller = PCA9685Controller()
+    if args.fps:
+        controller.FRAME_RATE = args.fps
+    with redirect_stdout(sys.stderr):
+        led_show = controller.create_light_show()
+        led_show.all_on()
+
+    runs = [(name, 'show', lambda name=name: led_show.run_light_show(name, duration=args.duration))
+            for name in SHOWS]
+    runs += [(name, 'effect', run) for name, run in effects(led_show, args.duration).items()]
+
+    results = []
+    for name, kind, run in runs:
+        if args.only and name not in args.only:
+            continue
+        controller.skipped_writes = 0
+        with redirect_stdout(sys.stderr):  # keep driver prints out of the JSON
+            results.append(measure(controller, sim, name, kind, args.duration, run))
+        print(f"{name}: {results[-1]['fps']:.1f} fps, "
+              f"{results[-1].get('transactions_per_frame', results[-1]['transactions']):.2f} transactions/frame",
+              file=sys.stderr)
+
+    report = {
+        'config': {
+            'duration_s': args.duration,
+            'bus_hz': args.bus_hz,
+            'overhead_us': args.overhead_us,
+            'realtime': not args.no_realtime,
+            'target_fps': args.fps or controller.FRAME_RATE,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import json
+import argparse
+
+import SimI2C
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+
+'''
+MCP9808 read path benchmark
+- compares the normal temperature read (read_word_data: pointer write, repeated start,
+  2-byte read) with streaming mode (pointer left on the temperature register, then plain
+  2-byte reads through i2c_rdwr)
+- runs the real MCP9808 driver on the simulated bus (SimI2C) with modelled bus time spent
+  for real, directly on InstrumentedSMBus and optionally through the BusOwner process
+- reports I2C transactions, wire bytes, modelled bus time and wall time per read
+- checks MCP9808.decode_temperature against the decoding the driver used before, for every
+  register value
+- checks that streaming recovers when the chip is reset under it: the simulated sensor loses
+  its pointer, MCP9808Array must not report register 0 as a temperature and sets the sensor up again
+- prints JSON, or writes it with --output
+
+example:
+    python3 bench_mcp9808.py --reads 2000 --bus-hz 100000 --bus-owner
+'''
+
+
+def legacy_threebit(temphex):
+    # the old _decode_threebit, kept here as the reference
+    temphex = temphex & 0x1fff
+    sign = (temphex & 0x1000) >> 12
+    temphex = temphex & 0xfff
+    temperature = (temphex >> 4) + ((temphex & 0xF) >> 1) / 8.0
+    return temperature - 256 if sign else temperature
+
+
+def legacy_integer(temphex):
+    # the old read_temperature decoding
+    temphex = temphex & 0x1fff
+    sign = (temphex & 0x1000) >> 12
+    integer_part = (temphex & 0xfff) >> 4
+    return integer_part - 256 if sign else integer_part
+
+
+def check_decoding():
+    from MCP9808mod5 import MCP9808
+
+    mismatches = {'threebit': 0, 'integer': 0, 'full': 0}
+    for temphex in range(0x10000):  # flag bits included, they must be ignored
+        if MCP9808.decode_temperature(temphex, 0.125) != legacy_threebit(temphex):
+            mismatches['threebit'] += 1
+        if int(MCP9808.decode_temperature(temphex, 1.0)) != legacy_integer(temphex):
+            mismatches['integer'] += 1
+        if MCP9808.decode_temperature(temphex, 0.0625) != SimI2C.SimMCP9808.decode(temphex):
+            mismatches['full'] += 1
+    return mismatches
+
+
+def check_pointer_reset(sim):
+    from MCP9808mod5 import MCP9808, MCP9808Array
+
+    chip = sim.devices[0x18]
+    setups = []
+
+    def setup(sensor):
+        setups.append(sensor.i2c_addr)
+        sensor.set_resolution(0.0625)
+
+    results = {}
+    for case, temperature in (('jump', 25.0), ('refresh', 2.0)):
+        # 'jump': register 0 decodes to 1.8 C, far from 25 C, the plausibility check catches it.
+        # 'refresh': at 2 C register 0 looks plausible, the periodic pointer write catches it
+        chip.temperature = temperature
+        sensors = MCP9808Array(sim, addresses=[0x18], setup=setup, streaming=True)
+        sensors.probe()
+        setups.clear()
+        for _ in range(3):
+            sensors.read_all(force=True)
+            time.sleep(chip.conversion_time)
+        chip.reset()
+        wrong = 0
+        for _ in range(MCP9808.POINTER_REFRESH_READS + 1):
+            temperature_read, _ = sensors.read_all(force=True)[0x18]
+            if temperature_read != temperature:
+                wrong += 1
+            time.sleep(chip.conversion_time)
+        results[case] = {'wrong_readings': wrong, 'setups_after_reset': len(setups)}
+    chip.temperature = 25.0
+    return results
+
+
+def measure(sensor, reads, counters):
+    '''counters() -> (transactions, wire bytes, modelled bus s), read before and after'''
+    sensor.read_temperature_flags()  # first read sets the pointer
+    before = counters()
+    start = time.perf_counter()
+    for _ in range(reads):
+        sensor.read_temperature_flags()
+    elapsed = time.perf_counter() - start
+    after = counters()
+    transactions, wire_bytes, bus_s = (a - b if b is not None else None for a, b in zip(after, before))
+    return {
+        'transactions_per_read': transactions / reads,
+        'wire_bytes_per_read': wire_bytes / reads if wire_bytes is not None else None,
+        'bus_us_per_read': bus_s * 1e6 / reads,
+        'wall_us_per_read': elapsed * 1e6 / reads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the MCP9808 read_word_data and streaming read paths')
+    parser.add_argument('--reads', type=int, default=2000, help='temperature reads per run (default 2000)')
+    parser.add_argument('--bus-hz', type=int, default=100000, help='modelled SCL frequency (default 100000)')
+    parser.add_argument('--overhead-us', type=float, default=50.0,
+                        help='fixed cost per transaction, kernel and ioctl time (default 50)')
+    parser.add_argument('--bus-owner', action='store_true', help='also run through the BusOwner process')
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    sim = SimI2C.install(bus_hz=args.bus_hz, overhead_us=args.overhead_us, realtime=True)
+    from MCP9808mod5 import MCP9808
+
+    mismatches = check_decoding()
+    print(f"decoding mismatches against the old routines: {mismatches}", file=sys.stderr)
+    pointer_reset = check_pointer_reset(sim)
+    print(f"streaming after a chip reset: {pointer_reset}", file=sys.stderr)
+
+    results = []
+    for streaming in (False, True):
+        path = 'streaming' if streaming else 'read_word_data'
+        sensor = MCP9808(streaming=streaming)
+        result = measure(sensor, args.reads, lambda: (sim.transactions, sim.bytes, sim.sim_time))
+        results.append({'path': path, 'via': 'InstrumentedSMBus', **result})
+
+    if args.bus_owner:
+        from busownermod import BusOwner
+        owner = BusOwner()
+        client = owner.create_client('mcp9808', BusOwner.PRIORITY_TEMPERATURE)
+        owner.start()  # forks, the owner process gets its own copy of the simulated bus
+
+        def counters():
+            device = client.stats()['bus']['devices'].get('0x18', {})
+            return device.get('transactions', 0), None, device.get('busy_s', 0.0)
+
+        for streaming in (False, True):
+            path = 'streaming' if streaming else 'read_word_data'
+            sensor = MCP9808(bus=client, streaming=streaming)
+            result = measure(sensor, args.reads, counters)
+            results.append({'path': path, 'via': 'BusOwner', **result})
+        owner.stop()
+
+    for result in results:
+        print(f"{result['via']:17s} {result['path']:14s}: {result['transactions_per_read']:.2f} transactions, "
+              f"{result['wire_bytes_per_read'] if result['wire_bytes_per_read'] is not None else '-'} wire bytes, "
+              f"{result['bus_us_per_read']:7.1f} us bus, {result['wall_us_per_read']:7.1f} us wall per read",
+              file=sys.stderr)
+
+    report = {
+        'config': {'reads': args.reads, 'bus_hz': args.bus_hz, 'overhead_us': args.overhead_us},
+        'decoding_mismatches': mismatches,
+        'pointer_reset': pointer_reset,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    assert report['pointer_reset']['jump']['wrong_readings'] == 0, 'a reset chip was decoded from the wrong register'
+    assert report['pointer_reset']['jump']['setups_after_reset'] == 1, 'a reset chip was not set up again'
+    assert report['pointer_reset']['refresh']['wrong_readings'] < MCP9808.POINTER_REFRESH_READS, \
+        'the pointer was never written again'
+
+
+if __name__ == "__main__":
+    main()
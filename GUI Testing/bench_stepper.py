@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import argparse
+from contextlib import redirect_stdout
+import numpy as np
+
+import SimGPIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+
+'''
+Stepper timing benchmark
+- runs the real Nema17 stepping loop on the recording GPIO module (SimGPIO)
+- for every RPM in the range, Full/Half and CW/CCW, moves a fixed number of steps and
+  replays the pin transitions into coil states
+- reports effective step rate and RPM, step interval jitter against the ideal interval,
+  coil states that are not the next phase of the sequence, and invalid coil states
+  (A1 and A2, or B1 and B2, high together), split into settled ones and transient ones
+  that only exist between the pin writes of one step; the run fails if there is any
+- prints JSON, or writes it with --output, so runs before/after a driver change can be diffed
+
+example:
+    python3 bench_stepper.py --steps 20 --output before.json
+'''
+
+A1, A2, B1, B2, SLP = 17, 18, 27, 22, 23
+
+
+def analyse(gpio, motor, rpm, direction, mode, half_step_phases, steps_per_rev):
+    times, masks, call_ids = gpio.coil_states(motor.coil_pins)
+    invalid = ((masks & 0b1010) == 0b1010) | ((masks & 0b0101) == 0b0101)  # A1+A2 or B1+B2
+
+    # the last transition of each output() call is the state the step settles in
+    settled = np.append(call_ids[1:] != call_ids[:-1], True) if len(call_ids) else np.zeros(0, dtype=bool)
+    step_times = times[settled]
+    step_masks = masks[settled]
+
+    # every settled state should be the next phase in the direction of travel
+    stride = (1 if direction == 'CW' else -1) * (2 if mode == 'Full' else 1)
+    index = {mask: i for i, mask in enumerate(half_step_phases)}
+    sequence_errors = 0
+    for previous, mask in zip(step_masks[:-1], step_masks[1:]):
+        if int(mask) not in index or int(previous) not in index \
+                or (index[int(previous)] + stride) % 8 != index[int(mask)]:
+            sequence_errors += 1
+
+    ideal_ns = 60e9 / (steps_per_rev * rpm)
+    result = {
+        'rpm': rpm,
+        'direction': direction,
+        'mode': mode,
+        'steps': int(len(step_times)),
+        'gpio_calls': gpio.calls,
+        'transitions': int(len(times)),
+        'invalid_settled': int(np.count_nonzero(invalid & settled)),
+        'invalid_transient': int(np.count_nonzero(invalid & ~settled)),
+        'sequence_errors': sequence_errors,
+    }
+    if len(step_times) > 1:
+        intervals = np.diff(step_times)
+        error_us = (intervals - ideal_ns) / 1000
+        step_rate = (len(step_times) - 1) * 1e9 / (step_times[-1] - step_times[0])
+        result.update({
+            'step_rate': step_rate,
+            'measured_rpm': step_rate * 60 / steps_per_rev,
+            'rpm_error_pct': (step_rate * 60 / steps_per_rev - rpm) / rpm * 100,
+            'jitter_us': {
+                'std': float(error_us.std()),
+                'p99_abs': float(np.percentile(np.abs(error_us), 99)),
+                'max_abs': float(np.abs(error_us).max()),
+            },
+            # time between the first and last pin write of a step
+            'step_write_us_max': float(max((times[call_ids == c][-1] - times[call_ids == c][0]) / 1000
+                                           for c in np.unique(call_ids))),
+        })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the Nema17 stepping loop on a recording fake GPIO')
+    parser.add_argument('--steps', type=int, default=20, help='steps per run (default 20)')
+    parser.add_argument('--rpm-min', type=int, default=1, help='lowest RPM (default 1)')
+    parser.add_argument('--rpm-max', type=int, default=50, help='highest RPM (default 50)')
+    parser.add_argument('--modes', nargs='*', default=['Full', 'Half'])
+    parser.add_argument('--directions', nargs='*', default=['CW', 'CCW'])
+    parser.add_argument('--accel', type=float, default=None,
+                        help='ramp at this many RPM/s (default: jump to speed, so jitter is steady state)')
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    gpio = SimGPIO.install()
+    import NEMA17mod2
+    from NEMA17mod2 import Nema17
+
+    motor = Nema17(A1_pin=A1, A2_pin=A2, B1_pin=B1, B2_pin=B2, sleep_pin=SLP)
+    motor.accel = args.accel
+    motor.wake()
+
+    results = []
+    for mode in args.modes:
+        for direction in args.directions:
+            for rpm in range(args.rpm_min, args.rpm_max + 1):
+                gpio.reset()
+                with redirect_stdout(sys.stderr):
+                    motor.move(steps=args.steps, rpm=rpm, direction=direction, mode=mode)
+                results.append(analyse(gpio, motor, rpm, direction, mode,
+                                       NEMA17mod2.HALF_STEP_PHASES, NEMA17mod2.STEPS_PER_REV[mode]))
+                r = results[-1]
+                print(f"{mode} {direction} {rpm:2d} RPM: {r.get('measured_rpm', 0):.2f} measured, "
+                      f"jitter std {r.get('jitter_us', {}).get('std', 0):.1f} us, "
+                      f"invalid {r['invalid_settled']}/{r['invalid_transient']} settled/transient, "
+                      f"{r['sequence_errors']} sequence errors", file=sys.stderr)
+    motor.sleep()
+
+    report = {
+        'config': {
+            'steps': args.steps,
+            'rpm_range': [args.rpm_min, args.rpm_max],
+            'accel': args.accel,
+            'dropped_transitions': gpio.dropped,
+        },
+        'totals': {
+            'invalid_settled': sum(r['invalid_settled'] for r in results),
+            'invalid_transient': sum(r['invalid_transient'] for r in results),
+            'sequence_errors': sum(r['sequence_errors'] for r in results),
+            'worst_jitter_std_us': max((r['jitter_us']['std'] for r in results if 'jitter_us' in r), default=0.0),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    # the backend writes released pins before energised ones, so neither kind may show up
+    totals = report['totals']
+    assert totals['invalid_settled'] == 0, f"{totals['invalid_settled']} settled invalid coil states"
+    assert totals['invalid_transient'] == 0, f"{totals['invalid_transient']} transient invalid coil states"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+
+'''
+Temperature sampling benchmark
+- compares the old fixed schedule (full resolution every 2 s) with MCP9808mod5.AdaptiveSampler
+- runs on a virtual clock against temperature traces, so an hour of sensor time takes milliseconds
+- a read returns the last finished conversion: the trace one conversion time ago,
+  truncated to the resolution step like the real sensor
+- reports reads and I2C bytes per minute (overall and before the trip) and how long
+  after the true trip crossing the first reading above the trip came in
+- averages the load before the trip over all traces for each policy, past the trip the
+  motor is stopped anyway
+
+example:
+    python3 bench_temperature.py --output sampling.json
+'''
+
+TRIP = 32.0
+READ_BYTES = 3  # pointer + 2 data bytes, as InstrumentedSMBus counts read_word_data
+RESOLUTION_BYTES = 2  # pointer + value
+
+
+def traces(duration):
+    '''name -> temperature(t)'''
+    return {
+        'stable 25C': lambda t: 25.0,
+        'slow ramp 0.01C/s': lambda t: 25.0 + 0.01 * max(0.0, t - 60),
+        'fast ramp 0.5C/s': lambda t: 25.0 + 0.5 * max(0.0, t - duration / 2),
+        'hover near trip': lambda t: 31.0 + 0.5 * ((t // 30) % 2),
+        'warm up to 30C': lambda t: 25.0 + 5.0 * min(1.0, t / 600),  # motor warming up, settles under the trip
+    }
+
+
+def quantize(temp_c, resolution):
+    return int(temp_c / resolution) * resolution
+
+
+def run(trace, duration, policy, conversion_times):
+    from MCP9808mod5 import AdaptiveSampler
+
+    sampler = AdaptiveSampler(TRIP)
+    resolution = 0.0625
+    t = 0.0
+    reads = 0
+    bus_bytes = 0
+    crossing = next((i / 10 for i in range(int(duration * 10)) if trace(i / 10) > TRIP), None)
+    detected = None
+    reads_before = bytes_before = 0
+    while t < duration:
+        reading = quantize(trace(max(0.0, t - conversion_times[resolution])), resolution)
+        reads += 1
+        bus_bytes += READ_BYTES
+        if detected is None and reading > TRIP:
+            detected = t
+        if crossing is None or t < crossing:
+            reads_before, bytes_before = reads, bus_bytes
+        if policy == 'fixed':
+            interval = 2.0
+        else:
+            new_resolution, interval = sampler.update(reading, t)
+            if new_resolution != resolution:
+                resolution = new_resolution
+                bus_bytes += RESOLUTION_BYTES
+        t += interval
+    minutes = duration / 60
+    minutes_before = (crossing if crossing is not None else duration) / 60
+    return {
+        'reads_per_min': reads / minutes,
+        'bytes_per_min': bus_bytes / minutes,
+        'bytes_per_min_before_trip': bytes_before / minutes_before if minutes_before else 0.0,
+        'trip_crossed_at_s': crossing,
+        'detection_delay_s': (detected - crossing) if crossing is not None and detected is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare fixed and adaptive MCP9808 sampling on temperature traces')
+    parser.add_argument('--duration', type=float, default=3600.0, help='seconds of sensor time per trace (default 3600)')
+    parser.add_argument('--output', default=None, help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    from MCP9808mod5 import MCP9808
+    conversion_times = {resolution: conv for resolution, (_, conv) in MCP9808.RESOLUTIONS.items()}
+
+    results = []
+    for name, trace in traces(args.duration).items():
+        for policy in ('fixed', 'adaptive'):
+            result = {'trace': name, 'policy': policy, **run(trace, args.duration, policy, conversion_times)}
+            results.append(result)
+            delay = result['detection_delay_s']
+            print(f"{name:20s} {policy:8s}: {result['reads_per_min']:6.1f} reads/min, "
+                  f"{result['bytes_per_min']:6.1f} bytes/min ({result['bytes_per_min_before_trip']:6.1f} before trip), "
+                  f"detection {'-' if delay is None else f'{delay:.2f} s'}", file=sys.stderr)
+
+    averages = {}
+    for policy in ('fixed', 'adaptive'):
+        loads = [r['bytes_per_min_before_trip'] for r in results if r['policy'] == policy]
+        averages[policy] = sum(loads) / len(loads)
+    print(f"average before trip: fixed {averages['fixed']:.1f} bytes/min, adaptive {averages['adaptive']:.1f} bytes/min",
+          file=sys.stderr)
+
+    report = {'config': {'duration_s': args.duration, 'trip_c': TRIP}, 'results': results,
+              'average_bytes_per_min_before_trip': averages}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
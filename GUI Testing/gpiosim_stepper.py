@@ -0,0 +1,108 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Final Working Files'))
+
+
+'''
+Run the Nema17 driver on the libgpiod backend against a simulated GPIO chip
+- needs Linux with the gpio-sim module (modprobe gpio-sim), configfs mounted, root,
+  and the libgpiod v2 python bindings (pip install gpiod)
+- creates a 32 line gpio-sim chip, so the BCM pin numbers the GUI uses are valid offsets
+- steps the motor one step at a time and reads every coil line back from sysfs to check the
+  phase sequence, then times the per-step write and a free-running move
+- removes the simulated chip again unless --keep
+
+example:
+    sudo modprobe gpio-sim
+    sudo python3 gpiosim_stepper.py --steps 400
+'''
+
+CONFIGFS = '/sys/kernel/config/gpio-sim'
+A1, A2, B1, B2, SLP = 17, 18, 27, 22, 23
+
+
+def write(path, value):
+    with open(path, 'w') as f:
+        f.write(value)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def create_chip(name, num_lines=32):
+    '''Make and enable a gpio-sim device, returns (device path, /dev/gpiochipN, sysfs line dir)'''
+    device = os.path.join(CONFIGFS, name)
+    bank = os.path.join(device, 'gpio-bank0')
+    os.mkdir(device)
+    os.mkdir(bank)
+    write(os.path.join(bank, 'num_lines'), str(num_lines))
+    write(os.path.join(device, 'live'), '1')
+    chip = read(os.path.join(bank, 'chip_name'))
+    lines = os.path.join('/sys/devices/platform', read(os.path.join(device, 'dev_name')), chip)
+    return device, os.path.join('/dev', chip), lines
+
+
+def remove_chip(device):
+    write(os.path.join(device, 'live'), '0')
+    os.rmdir(os.path.join(device, 'gpio-bank0'))
+    os.rmdir(device)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the gpiod stepper backend on a gpio-sim chip')
+    parser.add_argument('--steps', type=int, default=400, help='steps for the timed move (default 400)')
+    parser.add_argument('--rpm', type=float, default=30.0, help='speed of the timed move (default 30)')
+    parser.add_argument('--writes', type=int, default=20000, help='writes for the per-step cost (default 20000)')
+    parser.add_argument('--keep', action='store_true', help='leave the simulated chip in place')
+    args = parser.parse_args()
+
+    if not os.path.isdir(CONFIGFS):
+        sys.exit(f'{CONFIGFS} not found: modprobe gpio-sim and mount configfs first (needs root)')
+
+    from gpiobackendmod import GpiodBackend
+    from NEMA17mod2 import Nema17, HALF_STEP_PHASES, A1_BIT, B1_BIT, A2_BIT, B2_BIT
+
+    device, chip, lines = create_chip(f'sunflow-{os.getpid()}')
+    print(f'simulated chip {chip}')
+    try:
+        backend = GpiodBackend(chip)
+        motor = Nema17(A1, A2, B1, B2, SLP, gpio=backend)
+        motor.accel = None
+
+        def coils():
+            # coil bitmask read back from the simulator, A1 B1 A2 B2 like HALF_STEP_PHASES
+            value = lambda pin: int(read(os.path.join(lines, f'sim_gpio{pin}', 'value')))
+            return ((A1_BIT if value(A1) else 0) | (B1_BIT if value(B1) else 0)
+                    | (A2_BIT if value(A2) else 0) | (B2_BIT if value(B2) else 0))
+
+        motor.wake()
+        assert read(os.path.join(lines, f'sim_gpio{SLP}', 'value')) == '1', 'SLP did not go high'
+        errors = 0
+        for direction, mode in (('CW', 'Full'), ('CCW', 'Full'), ('CW', 'Half'), ('CCW', 'Half')):
+            for _ in range(16):
+                motor.move(steps=1, rpm=50, direction=direction, mode=mode)
+                if coils() != HALF_STEP_PHASES[motor.phase]:
+                    errors += 1
+        print(f'phase check: {errors} mismatches over 64 single steps')
+
+        start = time.perf_counter_ns()
+        for i in range(args.writes):
+            backend.write(motor.phase_writes[i % 8])
+        per_write_us = (time.perf_counter_ns() - start) / args.writes / 1000
+        print(f'one step write (set_values ioctl): {per_write_us:.2f} us')
+
+        motor.move(steps=args.steps, rpm=args.rpm)
+        print(motor.timing_report())
+        motor.close()
+    finally:
+        if not args.keep:
+            remove_chip(device)
+
+
+if __name__ == "__main__":
+    main()